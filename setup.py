@@ -11,6 +11,7 @@ setup(
         "pinecone-client",
         "python-dotenv",
         "numpy",
+        "orjson",
     ],
     python_requires=">=3.9",
 ) 
\ No newline at end of file
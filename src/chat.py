@@ -47,7 +47,8 @@ async def generate_response(
         if not conversation:
             conversation = Conversation(
                 id=conversation_id,
-                storage_dir=conversation_manager.storage_dir
+                storage_dir=conversation_manager.storage_dir,
+                backend=conversation_manager.backend
             )
             conversation_manager.conversations[conversation_id] = conversation
         
@@ -92,15 +93,12 @@ async def generate_response(
                 "content": f"Here is some relevant information:\n\n{context_text}"
             })
         
-        # Add conversation history
+        # Add conversation history (already ending with the current query)
         messages.extend([
             {"role": msg["role"], "content": msg["content"]}
             for msg in conversation_context
         ])
-        
-        # Add current query
-        messages.append({"role": "user", "content": query})
-        
+
         # Generate response
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
@@ -2,15 +2,15 @@
 Enhanced conversation management module with persistence and context handling.
 """
 
-import json
+from abc import ABC, abstractmethod
+import orjson
 import time
 import uuid
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Tuple, Union
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 import os
 from pathlib import Path
-from src.api.models import Message, Conversation, ConversationMetadata
 
 @dataclass
 class Message:
@@ -30,6 +30,7 @@ class Conversation:
     max_messages: int = 50
     created_at: float = field(default_factory=time.time)
     last_updated: float = field(default_factory=time.time)
+    backend: Optional["StorageBackend"] = field(default=None, repr=False, compare=False)
     
     def add_message(self, role: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
         """Add a message with metadata to the conversation"""
@@ -42,6 +43,16 @@ class Conversation:
         self._prune_history()
         self.save()
     
+    def add_messages(self, items: List[Tuple]) -> None:
+        """Add several (role, content[, metadata]) messages, saving once"""
+        self.messages.extend(
+            Message(role=item[0], content=item[1], metadata=(item[2] if len(item) > 2 else None) or {})
+            for item in items
+        )
+        self.last_updated = time.time()
+        self._prune_history()
+        self.save()
+    
     def get_messages(self, limit: Optional[int] = None) -> List[Dict[str, str]]:
         """Get formatted messages for the OpenAI API"""
         messages = self.messages[-limit:] if limit else self.messages
@@ -118,55 +129,120 @@ class Conversation:
         return conv
     
     def save(self) -> None:
-        """Save conversation to disk"""
+        """Save conversation through its storage backend, or to storage_dir"""
+        if self.backend is not None:
+            self.backend.save(self)
+            return
         if not self.storage_dir:
             print(f"Warning: No storage directory set for conversation {self.id}")
             return
-            
+        JSONFileBackend(self.storage_dir).save(self)
+
+class StorageBackend(ABC):
+    """Interface for conversation persistence"""
+    @abstractmethod
+    def save(self, conversation: Conversation) -> None:
+        """Persist a conversation"""
+    
+    @abstractmethod
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Load a stored conversation dict by ID"""
+    
+    @abstractmethod
+    def list(self) -> List[Dict[str, Any]]:
+        """Load all stored conversation dicts"""
+    
+    @abstractmethod
+    def delete(self, conversation_id: str) -> None:
+        """Remove a stored conversation"""
+
+def _dump_json(data: Dict[str, Any], file_path: Path) -> None:
+    """Write data as indented JSON"""
+    file_path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+def _load_json(file_path: Path) -> Dict[str, Any]:
+    """Read a JSON file"""
+    return orjson.loads(file_path.read_bytes())
+
+class JSONFileBackend(StorageBackend):
+    """Stores each conversation as <id>.json in a directory"""
+    def __init__(self, storage_dir: Union[str, Path]):
+        self.storage_dir = Path(storage_dir)
+    
+    def _path(self, conversation_id: str) -> Path:
+        return self.storage_dir.absolute() / f"{conversation_id}.json"
+    
+    def save(self, conversation: Conversation) -> None:
         try:
             self.storage_dir.mkdir(parents=True, exist_ok=True)
-            file_path = self.storage_dir.absolute() / f"{self.id}.json"
-            print(f"Saving conversation {self.id} to {file_path}")
-            with open(file_path, "w") as f:
-                json.dump(self.to_dict(), f, indent=2)
-            print(f"Successfully saved conversation {self.id}")
+            file_path = self._path(conversation.id)
+            print(f"Saving conversation {conversation.id} to {file_path}")
+            _dump_json(conversation.to_dict(), file_path)
+            print(f"Successfully saved conversation {conversation.id}")
         except Exception as e:
-            print(f"Error saving conversation {self.id}: {e}")
+            print(f"Error saving conversation {conversation.id}: {e}")
+    
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        file_path = self._path(conversation_id)
+        if not file_path.exists():
+            return None
+        return _load_json(file_path)
+    
+    def list(self) -> List[Dict[str, Any]]:
+        data = []
+        for file_path in self.storage_dir.glob("*.json"):
+            try:
+                data.append(_load_json(file_path))
+            except Exception as e:
+                print(f"Error loading conversation {file_path}: {e}")
+        return data
+    
+    def delete(self, conversation_id: str) -> None:
+        file_path = self._path(conversation_id)
+        if file_path.exists():
+            file_path.unlink()
+
+class InMemoryBackend(StorageBackend):
+    """Keeps conversation dicts in memory; useful for tests"""
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+    
+    def save(self, conversation: Conversation) -> None:
+        self._data[conversation.id] = conversation.to_dict()
+    
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return self._data.get(conversation_id)
+    
+    def list(self) -> List[Dict[str, Any]]:
+        return list(self._data.values())
+    
+    def delete(self, conversation_id: str) -> None:
+        self._data.pop(conversation_id, None)
 
 class ConversationManager:
     """Manages multiple conversations with persistence"""
-    def __init__(self, storage_dir: str = "conversations"):
+    def __init__(self, storage_dir: str = "conversations", backend: Optional[StorageBackend] = None):
         self.storage_dir = Path(storage_dir)
-        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        if backend is None:
+            self.storage_dir.mkdir(parents=True, exist_ok=True)
+            backend = JSONFileBackend(self.storage_dir)
+        self.backend = backend
         self.conversations: Dict[str, Conversation] = {}
         self._load_conversations()
     
     def _load_conversations(self) -> None:
-        """Load all conversations from disk"""
-        for file_path in self.storage_dir.glob("*.json"):
+        """Load all conversations from the storage backend"""
+        for data in self.backend.list():
             try:
-                with open(file_path) as f:
-                    data = json.load(f)
-                    conv = Conversation.from_dict(data, storage_dir=self.storage_dir)
-                    self.conversations[conv.id] = conv
+                conv = Conversation.from_dict(data, storage_dir=self.storage_dir)
+                conv.backend = self.backend
+                self.conversations[conv.id] = conv
             except Exception as e:
-                print(f"Error loading conversation {file_path}: {e}")
+                print(f"Error loading conversation {data.get('id')}: {e}")
     
     def _save_conversation(self, conversation: Conversation) -> None:
-        """Save conversation to disk"""
-        if not conversation.storage_dir:
-            print(f"Warning: No storage directory set for conversation {conversation.id}")
-            return
-            
-        try:
-            conversation.storage_dir.mkdir(parents=True, exist_ok=True)
-            file_path = conversation.storage_dir.absolute() / f"{conversation.id}.json"
-            print(f"Saving conversation {conversation.id} to {file_path}")
-            with open(file_path, "w") as f:
-                json.dump(conversation.to_dict(), f, indent=2)
-            print(f"Successfully saved conversation {conversation.id}")
-        except Exception as e:
-            print(f"Error saving conversation {conversation.id}: {e}")
+        """Save conversation through the storage backend"""
+        self.backend.save(conversation)
     
     def get_conversation(self, conversation_id: str) -> Optional[Conversation]:
         """Get a conversation by ID"""
@@ -178,6 +254,7 @@ class ConversationManager:
         conv = self.get_conversation(conversation_id)
         if conv:
             conv.storage_dir = self.storage_dir  # Ensure storage directory is set
+            conv.backend = self.backend
             conv.add_message(role, content, metadata)
     
     def get_recent_conversations(self, limit: int = 10) -> List[Conversation]:
@@ -191,16 +268,13 @@ class ConversationManager:
     
     def cleanup_old_conversations(self, days_old: int = 30) -> None:
         """Remove conversations older than specified days"""
-        cutoff = datetime.now() - timedelta(days=days_old)
+        cutoff = (datetime.now() - timedelta(days=days_old)).timestamp()
         to_remove = []
         
         for conv_id, conv in self.conversations.items():
             if conv.last_updated < cutoff:
                 to_remove.append(conv_id)
-                # Remove file
-                file_path = self.storage_dir / f"{conv_id}.json"
-                if file_path.exists():
-                    file_path.unlink()
+                self.backend.delete(conv_id)
         
         # Remove from memory
         for conv_id in to_remove:
@@ -240,6 +314,7 @@ async def save_conversation(conversation_id: Optional[str], query: str, response
         conversation = Conversation(
             id=conversation_id,
             storage_dir=conversation_manager.storage_dir,
+            backend=conversation_manager.backend,
             messages=[],
             metadata=metadata
         )
@@ -1,5 +1,6 @@
 import os
-from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from openai import OpenAI
 from dataclasses import dataclass
 import numpy as np
@@ -14,6 +15,7 @@ load_dotenv(override=True)
 EMBEDDING_MODEL = "text-embedding-ada-002"
 MAX_RETRIES = 3
 RETRY_DELAY = 1.0
+EMBEDDING_CACHE_SIZE = 4096
 
 # Initialize OpenAI client with API key from environment variable
 api_key = os.getenv("OPENAI_API_KEY")
@@ -30,6 +32,10 @@ class EmbeddedChunk:
     embedding: List[float]
     metadata: Dict[str, Any]
 
+# Embeddings of recently seen texts, least recently used first; stored as tuples
+# so no caller can mutate a shared cached vector
+_embedding_cache: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+
 def get_openai_client() -> Optional[OpenAI]:
     """
     Get an initialized OpenAI client
@@ -59,6 +65,12 @@ async def get_embedding(text: str) -> Optional[List[float]]:
     Returns:
         Optional[List[float]]: Embedding vector or None if generation fails
     """
+    # Repeated queries are served from the cache without an API call
+    cached = _embedding_cache.get(text)
+    if cached is not None:
+        _embedding_cache.move_to_end(text)
+        return list(cached)
+        
     client = get_openai_client()
     if not client:
         return None
@@ -70,7 +82,11 @@ async def get_embedding(text: str) -> Optional[List[float]]:
                     model=EMBEDDING_MODEL,
                     input=text
                 )
-                return response.data[0].embedding
+                embedding = tuple(response.data[0].embedding)
+                _embedding_cache[text] = embedding
+                if len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+                    _embedding_cache.popitem(last=False)
+                return list(embedding)
             except Exception as e:
                 if attempt == MAX_RETRIES - 1:
                     print(f"Failed to generate embedding after {MAX_RETRIES} attempts: {str(e)}")
@@ -146,7 +162,7 @@ async def create_restaurant_embedding(restaurant: Dict[str, Any]) -> Optional[Em
         
         # Generate embedding
         embedding = await get_embedding(text)
-        if not embedding:
+        if embedding is None or len(embedding) == 0:
             return None
             
         return EmbeddedChunk(
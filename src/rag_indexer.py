@@ -1,5 +1,6 @@
 import os
 import json
+import numpy as np
 import pandas as pd
 from typing import Dict, List
 from openai import OpenAI
@@ -314,7 +315,7 @@ Price Range: {item['price']}
     
     return chunks
 
-def save_chunks(chunks: List[Dict], output_file: str, test_mode: bool = False):
+def save_chunks(chunks: List[Dict], output_file: str, test_mode: bool = False, fp16_embeddings: bool = False):
     """Save chunks with embeddings to a JSON file."""
     # In test mode, save to a sample file
     if test_mode:
@@ -330,6 +331,16 @@ def save_chunks(chunks: List[Dict], output_file: str, test_mode: bool = False):
     for chunk in chunks:
         chunks_by_type[chunk['metadata']['type']] += 1
     
+    if fp16_embeddings:
+        # Store embeddings as a float16 matrix next to the JSON; each chunk keeps its row index
+        embeddings_file = os.path.splitext(output_file)[0] + '_embeddings.npy'
+        np.save(embeddings_file, np.asarray([chunk['embedding'] for chunk in chunks], dtype=np.float16))
+        logging.info(f"Saved float16 embeddings to {embeddings_file}")
+        chunks = [
+            {**{key: value for key, value in chunk.items() if key != 'embedding'}, 'embedding_id': i}
+            for i, chunk in enumerate(chunks)
+        ]
+    
     # Save the chunks
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(chunks, f, ensure_ascii=False, indent=2)
@@ -534,6 +545,7 @@ def main():
     parser.add_argument('--batch-size', type=int, default=100, help='Batch size for Pinecone uploads')
     parser.add_argument('--clear-index', action='store_true', help='Clear the Pinecone index before uploading')
     parser.add_argument('--skip-pinecone', action='store_true', help='Skip uploading to Pinecone')
+    parser.add_argument('--fp16-embeddings', action='store_true', help='Save embeddings to a float16 .npy file instead of inline JSON')
     args = parser.parse_args()
     
     try:
@@ -561,7 +573,7 @@ def main():
         logging.info(f"Processed {len(chunks)} chunks")
     
     # Save chunks locally
-        save_chunks(chunks, args.output, test_mode=args.test)
+        save_chunks(chunks, args.output, test_mode=args.test, fp16_embeddings=args.fp16_embeddings)
         
         # Upload to Pinecone if not skipped
         if not args.skip_pinecone:
@@ -0,0 +1,74 @@
+"""
+Token-bucket rate limiting shared by the scrapers and the Pinecone uploader.
+"""
+
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` requests per second on average.
+
+    With min_rate/max_rate set, the rate adapts to throttling (AIMD):
+    on_success() raises it additively and on_throttle() cuts it multiplicatively.
+    """
+    def __init__(self, rate: float = 100.0, capacity: Optional[float] = None,
+                 min_rate: Optional[float] = None, max_rate: Optional[float] = None,
+                 increase: float = 1.0, decrease: float = 0.5):
+        self.rate = rate
+        self.capacity = capacity  # None allows a burst of up to one second's worth of requests
+        self.min_rate = rate if min_rate is None else min_rate
+        self.max_rate = rate if max_rate is None else max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = self._burst
+        self.last_refill = time.monotonic()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_interval(cls, interval: float) -> 'TokenBucket':
+        """One request per `interval` seconds on average; no limit when interval <= 0."""
+        if interval <= 0:
+            return cls(rate=math.inf, capacity=1.0)
+        return cls(rate=1.0 / interval, capacity=1.0)
+
+    @property
+    def _burst(self) -> float:
+        return self.rate if self.capacity is None else self.capacity
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self._burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """Block until a request may be sent.
+
+        Time spent on the previous request counts towards the wait, so slow
+        responses are not followed by a full extra delay.
+        """
+        if math.isinf(self.rate):
+            return
+        with self._cond:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self._cond.wait((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        """Additively increase the rate after a successful request."""
+        with self._cond:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._cond.notify_all()
+
+    def on_throttle(self):
+        """Multiplicatively decrease the rate and drop queued burst after a 429."""
+        with self._cond:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = 0
+            logging.warning(f"Rate limited, reducing request rate to {self.rate:.1f}/s")
@@ -1,13 +1,16 @@
 import os
 import json
+import orjson
 import logging
 import time
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-import hashlib
+import xxhash
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from newspaper import Article, Config
+import trafilatura
 from tqdm import tqdm
 import argparse
 import sys
@@ -19,6 +22,7 @@ import nltk
 from tenacity import retry, stop_after_attempt, wait_exponential
 import random
 import re
+from src.rate_limit import TokenBucket
 
 # Download required NLTK data
 try:
@@ -98,14 +102,19 @@ class NewsArticleScraper:
             }
         }
         
-        # initialize session with default headers
+        # initialize session with default headers; pooled keep-alive connections
+        # let repeated downloads reuse TCP/TLS handshakes
         self.session = requests.Session()
         self.session.headers.update(self.default_headers)
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=3)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         
         # configuration
         self.max_articles = int(os.getenv('MAX_ARTICLES_PER_SOURCE', 50))
         self.chunk_size = int(os.getenv('CHUNK_SIZE', 1000))
         self.rate_limit_delay = int(os.getenv('RATE_LIMIT_DELAY', 1))
+        self._limiter = TokenBucket.from_interval(self.rate_limit_delay)
         self.historical_months = int(os.getenv('HISTORICAL_DATA_MONTHS', 12))
         
         # track processed URLs to avoid duplicates
@@ -172,7 +181,7 @@ class NewsArticleScraper:
     def generate_chunk_id(self, content: str, source: str, date: str) -> str:
         """Generate a unique ID for a chunk based on its content and metadata."""
         unique_string = f"{content}{source}{date}"
-        return f"news_{hashlib.md5(unique_string.encode()).hexdigest()}"
+        return f"news_{xxhash.xxh3_64_hexdigest(unique_string.encode())}"
         
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content."""
@@ -616,12 +625,11 @@ class NewsArticleScraper:
                     timestamp = snapshot[1]
                     archive_url = f"http://web.archive.org/web/{timestamp}/{url}"
                     
+                    self._limiter.acquire()
                     article = self.extract_article_content(archive_url)
                     if article and article['text'].strip():
                         chunks.extend(self.chunk_article(article))
                     
-                    time.sleep(self.rate_limit_delay)  # Rate limiting
-                    
                 except Exception as e:
                     logging.warning(f"Failed to process snapshot {archive_url}: {str(e)}")
                     continue
@@ -694,6 +702,7 @@ class NewsArticleScraper:
                     }
                     logging.info(f"Making NewsAPI request with params: {json.dumps({k:v for k,v in request_params.items() if k != 'apiKey'}, indent=2)}")
 
+                    self._limiter.acquire()
                     response = requests.get(
                         'https://newsapi.org/v2/everything',
                         params={
@@ -731,6 +740,12 @@ class NewsArticleScraper:
                                 logging.warning("Skipping article due to missing required fields")
                                 continue
                                 
+                            # Skip URLs already returned by an earlier query before any content is fetched
+                            if article['url'] in self.processed_urls:
+                                logging.info("Skipping duplicate article URL")
+                                continue
+                            self.processed_urls.add(article['url'])
+                                
                             # Convert publishedAt to UTC datetime object
                             try:
                                 pub_date = datetime.strptime(article['publishedAt'], '%Y-%m-%dT%H:%M:%SZ')
@@ -750,11 +765,8 @@ class NewsArticleScraper:
                                 if '[+' in api_content and article['url']:  # Content is truncated
                                     try:
                                         logging.info(f"Attempting to fetch full content from: {article['url']}")
-                                        news_article = Article(article['url'], config=config)
-                                        news_article.download()
-                                        news_article.parse()
-                                        if news_article.text:
-                                            full_content = news_article.text
+                                        full_content = self.extract_full_content(article['url'], config)
+                                        if full_content:
                                             logging.info(f"Successfully extracted full content: {len(full_content)} chars")
                                     except Exception as e:
                                         logging.warning(f"Failed to fetch full content: {str(e)}")
@@ -779,23 +791,12 @@ class NewsArticleScraper:
                     else:
                         logging.error(f"Error in NewsAPI response: {data.get('message', 'Unknown error')}")
                     
-                    time.sleep(1)  # Rate limiting
-                    
                 except Exception as e:
                     logging.error(f"Error fetching articles for query '{query}': {str(e)}")
                     continue
 
-            # Remove duplicates based on URL
-            seen_urls = set()
-            unique_articles = []
-            for article in articles:
-                url = article.get('url')
-                if url and url not in seen_urls:
-                    seen_urls.add(url)
-                    unique_articles.append(article)
-
-            logging.info(f"Found {len(unique_articles)} unique articles after deduplication")
-            return unique_articles
+            logging.info(f"Found {len(articles)} unique articles after deduplication")
+            return articles
 
         except Exception as e:
             logging.error(f"Error in get_newsapi_articles: {str(e)}")
@@ -805,8 +806,18 @@ class NewsArticleScraper:
     def extract_full_content(self, url: str, config: Config) -> Optional[str]:
         """Extract full article content from URL with retry logic."""
         try:
+            # Download through the shared session instead of newspaper's own requests
+            response = self.session.get(url, timeout=config.request_timeout)
+            response.raise_for_status()
+            html = response.text
+            
+            text = trafilatura.extract(html, include_comments=False, favor_precision=True)
+            if text:
+                return text
+            
+            # Fall back to newspaper for pages trafilatura can't handle
             article = Article(url, config=config)
-            article.download()
+            article.set_html(html)
             article.parse()
             return article.text if article.text else None
         except Exception as e:
@@ -826,12 +837,11 @@ class NewsArticleScraper:
             publish_date = article.get('publish_date')
             image_url = article.get('image_url', '')
 
-            if not url or url in self.processed_urls:
-                logging.warning(f"Skipping article - {'No URL' if not url else 'Already processed'}")
+            # Duplicate URLs were already dropped by get_newsapi_articles
+            if not url:
+                logging.warning("Skipping article - No URL")
                 return []
 
-            self.processed_urls.add(url)
-
             # Create chunks from the article content
             chunks = []
             
@@ -859,54 +869,18 @@ class NewsArticleScraper:
                 
                 # Split content into paragraphs
                 paragraphs = content.split('\n\n')
-                current_chunk = ""
+                buf, buf_len = [], 0
                 chunk_number = 1
-                
-                for paragraph in paragraphs:
-                    paragraph = paragraph.strip()
-                    if not paragraph:
-                        continue
-
-                    # If adding this paragraph would exceed chunk size, create a new chunk
-                    if len(current_chunk) + len(paragraph) > 1000:
-                        if current_chunk:
-                            chunk_id = self.generate_chunk_id(
-                                current_chunk, 
-                                source, 
-                                f"{publish_date}_{chunk_number}"
-                            )
-                            
-                            content_chunk = {
-                                "id": chunk_id,
-                                "text": current_chunk,
-                                "metadata": {
-                                    "source": source,
-                                    "title": title,
-                                    "url": url,
-                                    "author": author,
-                                    "publish_date": publish_date,
-                                    "chunk_type": "content",
-                                    "chunk_number": chunk_number,
-                                    "type": "article"
-                                }
-                            }
-                            chunks.append(content_chunk)
-                            chunk_number += 1
-                            current_chunk = paragraph
-                    else:
-                        current_chunk += "\n\n" + paragraph if current_chunk else paragraph
 
-                # Add any remaining content as the final chunk
-                if current_chunk:
-                    chunk_id = self.generate_chunk_id(
-                        current_chunk,
-                        source,
-                        f"{publish_date}_{chunk_number}"
-                    )
-                    
-                    content_chunk = {
-                        "id": chunk_id,
-                        "text": current_chunk,
+                def flush(buf: List[str], chunk_number: int) -> Dict:
+                    text = "\n\n".join(buf)
+                    return {
+                        "id": self.generate_chunk_id(
+                            text,
+                            source,
+                            f"{publish_date}_{chunk_number}"
+                        ),
+                        "text": text,
                         "metadata": {
                             "source": source,
                             "title": title,
@@ -918,7 +892,25 @@ class NewsArticleScraper:
                             "type": "article"
                         }
                     }
-                    chunks.append(content_chunk)
+                
+                for paragraph in paragraphs:
+                    paragraph = paragraph.strip()
+                    if not paragraph:
+                        continue
+
+                    # If adding this paragraph would exceed chunk size, create a new chunk
+                    if buf and buf_len + len(paragraph) > 1000:
+                        chunks.append(flush(buf, chunk_number))
+                        chunk_number += 1
+                        buf, buf_len = [paragraph], len(paragraph)
+                    else:
+                        # buf_len tracks the joined length, including separators
+                        buf_len += len(paragraph) + (2 if buf else 0)
+                        buf.append(paragraph)
+
+                # Add any remaining content as the final chunk
+                if buf:
+                    chunks.append(flush(buf, chunk_number))
 
             logging.info(f"Created {len(chunks)} chunks for article: {title}")
             return chunks
@@ -949,8 +941,8 @@ class NewsArticleScraper:
             output_file = 'data/news_chunks_sample.json' if test_mode else 'data/news_chunks.json'
             os.makedirs(os.path.dirname(output_file), exist_ok=True)
             
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(all_chunks, f, ensure_ascii=False, indent=2)
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(all_chunks, option=orjson.OPT_INDENT_2))
             
             logging.info(f"Saved {len(all_chunks)} chunks to {output_file}")
             
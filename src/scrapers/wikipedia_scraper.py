@@ -1,15 +1,18 @@
 import os
-import json
+import orjson
 import logging
-import time
+import re
 from typing import List, Dict, Optional
+from collections import deque
+from itertools import islice
 import wikipediaapi
 from bs4 import BeautifulSoup
 import requests
 from tqdm import tqdm
-import hashlib
+import xxhash
 from datetime import datetime
 import argparse  # Add argparse for command line arguments
+from src.rate_limit import TokenBucket
 
 # Set up logging
 logging.basicConfig(
@@ -21,6 +24,43 @@ logging.basicConfig(
     ]
 )
 
+def _keyword_pattern(*keywords: str) -> re.Pattern:
+    """Compile keywords into one alternation matching any of them anywhere in a string."""
+    return re.compile('|'.join(map(re.escape, keywords)))
+
+# Title keywords for (sub)category classification, checked in order; substring
+# matches, so compounds like "Seafood" and plurals like "cuisines" still hit
+_CATEGORY_KEYWORDS = (
+    ('cuisine', _keyword_pattern('cuisine', 'food', 'dish', 'meal')),
+    ('ingredient', _keyword_pattern('ingredient', 'spice', 'herb')),
+    ('technique', _keyword_pattern('cooking', 'technique', 'method')),
+    ('restaurant', _keyword_pattern('restaurant', 'eatery', 'dining')),
+)
+_SUBCATEGORY_KEYWORDS = (
+    ('history', _keyword_pattern('history', 'origin', 'background')),
+    ('preparation', _keyword_pattern('preparation', 'cooking', 'recipe')),
+    ('ingredients', _keyword_pattern('ingredient', 'component')),
+    ('variations', _keyword_pattern('variation', 'type', 'style')),
+    ('cultural', _keyword_pattern('culture', 'tradition', 'custom')),
+)
+# Whitespace-delimited tokens wrapped in brackets, e.g. reference markers [1], [2]
+_BRACKET_TOKEN_RE = re.compile(r'(?<!\S)\[\S*\](?!\S)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+# TextExtracts only returns several extracts per request in intro mode, capped at 20
+PAGE_BATCH_SIZE = 20
+# Only the first few links of each page are kept as related pages
+MAX_RELATED_TITLES = 10
+
+def _classify_title(title: str, rules) -> str:
+    """Return the first label whose keyword pattern occurs in the title."""
+    title_lower = title.lower()
+    for label, pattern in rules:
+        if pattern.search(title_lower):
+            return label
+    return 'general'
+
 class WikipediaScraper:
     def __init__(self, user_agent: str = "RestaurantChatbot/1.0"):
         self.wiki = wikipediaapi.Wikipedia(
@@ -42,60 +82,72 @@ class WikipediaScraper:
         # Track processed pages to avoid duplicates
         self.processed_pages = set()
         
+        # Shallowest depth each category has been traversed at, shared across base
+        # categories so overlapping subcategories are only fetched again when
+        # reached at a shallower depth (where more of their subtree is in range)
+        self._visited_categories: Dict[str, int] = {}
+        
+        # Space out MediaWiki API requests
+        self._limiter = TokenBucket.from_interval(1.0)
+        
     def generate_chunk_id(self, content: str) -> str:
         """Generate a unique ID for a chunk based on its content."""
-        return f"wiki_{hashlib.md5(content.encode()).hexdigest()}"
+        return f"wiki_{xxhash.xxh3_64_hexdigest(content.encode())}"
         
     def get_category_members(self, category_name: str, max_depth: int = 2) -> List[str]:
-        """Recursively get all pages in a category up to max_depth."""
+        """Get all pages in a category and its subcategories up to max_depth."""
         logging.info(f"Getting members of category: {category_name}")
-        pages = []
-        visited_categories = set()
+        pages = set()
+        visited_categories = self._visited_categories
         
-        def _get_members(cat_name: str, depth: int):
-            if depth > max_depth or cat_name in visited_categories:
-                return
+        # Depth-first traversal with an explicit stack so deep category trees
+        # can't hit the recursion limit
+        stack = deque([(category_name, 0)])
+        while stack:
+            cat_name, depth = stack.pop()
+            if depth > max_depth or visited_categories.get(cat_name, max_depth + 1) <= depth:
+                continue
                 
-            visited_categories.add(cat_name)
+            visited_categories[cat_name] = depth
             category = self.wiki.page(cat_name)
             
             if not category.exists():
                 logging.warning(f"Category does not exist: {cat_name}")
-                return
+                continue
                 
             # Get all pages in this category
+            subcategories = []
             for member in category.categorymembers.values():
-                if "Category:" in member.title:
-                    _get_members(member.title, depth + 1)
+                if member.namespace == wikipediaapi.Namespace.CATEGORY:
+                    subcategories.append((member.title, depth + 1))
                 else:
-                    pages.append(member.title)
+                    pages.add(member.title)
                     
-        _get_members(category_name, 0)
-        return list(set(pages))  # Remove duplicates
+            # Reversed so subcategories are visited in their listed order
+            stack.extend(reversed(subcategories))
+            
+        return list(pages)
         
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content."""
-        # Remove multiple newlines
-        text = '\n'.join(line.strip() for line in text.split('\n') if line.strip())
         # Remove references [1], [2], etc.
-        text = ' '.join(word for word in text.split() if not (word.startswith('[') and word.endswith(']')))
-        return text
+        text = _BRACKET_TOKEN_RE.sub('', text)
+        # Collapse newlines and runs of whitespace
+        return _WHITESPACE_RE.sub(' ', text).strip()
         
     def extract_section_hierarchy(self, page) -> List[Dict]:
         """Extract the section hierarchy of a Wikipedia page."""
         sections = []
         
-        def _process_section(section, depth=0):
+        stack = deque((section, 0) for section in reversed(page.sections))
+        while stack:
+            section, depth = stack.pop()
             sections.append({
                 'title': section.title,
                 'level': depth,
                 'text': self.clean_text(section.text)
             })
-            for subsection in section.sections:
-                _process_section(subsection, depth + 1)
-                
-        for section in page.sections:
-            _process_section(section)
+            stack.extend((subsection, depth + 1) for subsection in reversed(section.sections))
             
         return sections
         
@@ -119,65 +171,96 @@ class WikipediaScraper:
         
     def determine_subcategory(self, section_title: str) -> str:
         """Determine the subcategory based on section title."""
-        title_lower = section_title.lower()
-        
-        if any(word in title_lower for word in ['history', 'origin', 'background']):
-            return 'history'
-        elif any(word in title_lower for word in ['preparation', 'cooking', 'recipe']):
-            return 'preparation'
-        elif any(word in title_lower for word in ['ingredient', 'component']):
-            return 'ingredients'
-        elif any(word in title_lower for word in ['variation', 'type', 'style']):
-            return 'variations'
-        elif any(word in title_lower for word in ['culture', 'tradition', 'custom']):
-            return 'cultural'
-        else:
-            return 'general'
+        return _classify_title(section_title, _SUBCATEGORY_KEYWORDS)
             
-    def scrape_page(self, title: str) -> Optional[Dict]:
-        """Scrape and process a single Wikipedia page."""
+    def _api_query(self, **params) -> Dict:
+        """Run a MediaWiki action=query request and return its full response."""
+        params.update(action='query', format='json', formatversion=2, maxlag=5)
+        self._limiter.acquire()
+        response = self.session.post(WIKIPEDIA_API_URL, data=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        if 'error' in data:
+            raise RuntimeError(f"MediaWiki API error: {data['error'].get('info', data['error'])}")
+        return data
+        
+    def fetch_page_batch(self, titles: List[str]) -> List[Dict]:
+        """Fetch URL, summary and links for up to PAGE_BATCH_SIZE pages in batched requests."""
+        params = dict(
+            prop='info|extracts|links',
+            inprop='url',
+            exintro=1,
+            explaintext=1,
+            exlimit='max',
+            plnamespace=0,
+            pllimit='max',
+            redirects=1,
+            titles='|'.join(titles)
+        )
+        
+        # The link limit is shared by the whole batch, so follow plcontinue until
+        # every page's links have been listed, merging each response by title
+        pages_by_title: Dict[str, Dict] = {}
+        while True:
+            data = self._api_query(**params)
+            for page in data.get('query', {}).get('pages', []):
+                merged = pages_by_title.setdefault(page['title'], {'links': []})
+                merged['links'].extend(page.pop('links', ()))
+                merged.update(page)
+            if 'continue' not in data:
+                break
+            params.update(data['continue'])
+        
+        pages = []
+        for page in pages_by_title.values():
+            if page.get('missing') or page.get('invalid'):
+                logging.warning(f"Page does not exist: {page.get('title')}")
+                continue
+            pages.append(page)
+        return pages
+        
+    def fetch_full_text(self, title: str) -> str:
+        """Fetch the plain-text extract of a whole page."""
+        # TextExtracts returns only one whole-page extract per request (several
+        # only with exintro), so full text is the one thing not fetched in batches
+        data = self._api_query(
+            prop='extracts',
+            explaintext=1,
+            exsectionformat='wiki',
+            titles=title
+        )
+        return data['query']['pages'][0].get('extract', '')
+        
+    def scrape_page(self, page: Dict) -> Optional[Dict]:
+        """Scrape and process a single Wikipedia page from its batch-fetched info."""
+        title = page['title']
         if title in self.processed_pages:
             return None
             
-        page = self.wiki.page(title)
-        if not page.exists():
-            logging.warning(f"Page does not exist: {title}")
-            return None
-            
+        text = self.fetch_full_text(title)
+        
         self.processed_pages.add(title)
         
         # Get related pages through links
-        related_titles = [link for link in list(page.links.keys())[:10]]  # Limit to top 10 related pages
+        related_titles = [link['title'] for link in page['links'][:MAX_RELATED_TITLES]]
         
         # Get the full text of the article
-        full_text = self.clean_text(page.text)
+        full_text = self.clean_text(text)
         
         content = {
-            'title': page.title,
-            'url': page.fullurl,
-            'summary': self.clean_text(page.summary),  # Get the summary
+            'title': title,
+            'url': page['fullurl'],
+            'summary': self.clean_text(page.get('extract', '')),  # Get the summary
             'text': full_text,  # Store full text instead of sections
             'related_titles': related_titles,
-            'category': self.determine_category(page.title, page.text)
+            'category': self.determine_category(title)
         }
         
         return content
         
-    def determine_category(self, title: str, text: str) -> str:
+    def determine_category(self, title: str) -> str:
         """Determine the main category of the article."""
-        title_lower = title.lower()
-        text_lower = text.lower()
-        
-        if any(word in title_lower for word in ['cuisine', 'food', 'dish', 'meal']):
-            return 'cuisine'
-        elif any(word in title_lower for word in ['ingredient', 'spice', 'herb']):
-            return 'ingredient'
-        elif any(word in title_lower for word in ['cooking', 'technique', 'method']):
-            return 'technique'
-        elif any(word in title_lower for word in ['restaurant', 'eatery', 'dining']):
-            return 'restaurant'
-        else:
-            return 'general'
+        return _classify_title(title, _CATEGORY_KEYWORDS)
             
     def scrape_all_categories(self, output_file: str = 'data/wikipedia_chunks.json', test_mode: bool = False):
         """Scrape all base categories and save chunks to file."""
@@ -196,29 +279,43 @@ class WikipediaScraper:
         
         logging.info(f"Found {len(all_pages)} unique pages to process")
         
-        # Process each page
-        for page_title in tqdm(all_pages, desc="Processing pages"):
-            try:
-                content = self.scrape_page(page_title)
-                if content:
-                    chunks = self.chunk_content(content)
-                    all_chunks.extend(chunks)
-                    
-                    # In test mode, provide more detailed logging
-                    if test_mode:
-                        logging.info(f"Processed page: {page_title}")
-                        logging.info(f"Generated {len(chunks)} chunks")
-                        logging.info(f"First chunk preview: {chunks[0]['text'][:200]}...")
-                    
-                    # Save progress periodically
-                    if len(all_chunks) % 1000 == 0:
-                        self.save_chunks(all_chunks, output_file)
-                    
-                time.sleep(1)  # Rate limiting
+        # Process pages in batches; page info, summaries and links are fetched per batch
+        # Checkpoint chunks as JSON lines as they are produced instead of rewriting the whole file
+        checkpoint_file = os.path.splitext(output_file)[0] + '.jsonl'
+        os.makedirs(os.path.dirname(checkpoint_file) or '.', exist_ok=True)
+        remaining = iter(all_pages)
+        with open(checkpoint_file, 'wb') as checkpoint, \
+                tqdm(total=len(all_pages), desc="Processing pages") as pbar:
+            while batch := list(islice(remaining, PAGE_BATCH_SIZE)):
+                try:
+                    pages = self.fetch_page_batch(batch)
+                except Exception as e:
+                    logging.error(f"Error fetching page batch starting at {batch[0]}: {str(e)}")
+                    pbar.update(len(batch))
+                    continue
                 
-            except Exception as e:
-                logging.error(f"Error processing page {page_title}: {str(e)}")
-                continue
+                for page in pages:
+                    page_title = page['title']
+                    try:
+                        content = self.scrape_page(page)
+                        if content:
+                            chunks = self.chunk_content(content)
+                            all_chunks.extend(chunks)
+                            for chunk in chunks:
+                                checkpoint.write(orjson.dumps(chunk))
+                                checkpoint.write(b"\n")
+                            
+                            # In test mode, provide more detailed logging
+                            if test_mode:
+                                logging.info(f"Processed page: {page_title}")
+                                logging.info(f"Generated {len(chunks)} chunks")
+                                logging.info(f"First chunk preview: {chunks[0]['text'][:200]}...")
+                            
+                    except Exception as e:
+                        logging.error(f"Error processing page {page_title}: {str(e)}")
+                        continue
+                
+                pbar.update(len(batch))
         
         # Save final results
         self.save_chunks(all_chunks, output_file)
@@ -226,8 +323,7 @@ class WikipediaScraper:
         # In test mode, also save a sample file
         if test_mode:
             sample_file = output_file.replace('.json', '_sample.json')
-            with open(sample_file, 'w', encoding='utf-8') as f:
-                json.dump(all_chunks[:5], f, ensure_ascii=False, indent=2)
+            self.save_chunks(all_chunks[:5], sample_file)
             logging.info(f"Saved {len(all_chunks)} sample chunks to {sample_file}")
         else:
             logging.info(f"Scraped {len(all_chunks)} chunks from {len(all_pages)} pages")
@@ -235,8 +331,8 @@ class WikipediaScraper:
     def save_chunks(self, chunks: List[Dict], output_file: str):
         """Save chunks to a JSON file."""
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, ensure_ascii=False, indent=2)
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(chunks, option=orjson.OPT_INDENT_2))
             
 def main():
     parser = argparse.ArgumentParser(description='Scrape Wikipedia for food and restaurant related content')
@@ -1,89 +1,191 @@
 import os
-import json
+import orjson
 import argparse
-from pinecone import Pinecone
+from pinecone import Pinecone, Vector
 from tqdm import tqdm
 import time
 import sys
+import mmap
+import queue
+import threading
 import ijson  # For streaming JSON processing
-import hashlib
+import xxhash
 import re
-from typing import List, Union, Dict, Tuple
+from typing import List, Union, Dict, Tuple, Optional
 import numpy as np
 from decimal import Decimal
+from functools import lru_cache
 import logging
+import logging.handlers
+from src.rate_limit import TokenBucket
 
-# Set up logging
+# Set up logging; file writes are buffered and flushed on errors or at exit
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_file_handler = logging.FileHandler('pinecone_upload.log', delay=True)
+_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('pinecone_upload.log')
+        logging.handlers.MemoryHandler(capacity=1000, flushLevel=logging.ERROR, target=_file_handler)
     ]
 )
 
+FAILED_IDS_FILE = 'failed_chunks.ndjson'  # Rewritten by each run that has failures, one JSON object per line
+FAILED_IDS_TO_SHOW = 10
+PROGRESS_LOG_INTERVAL = 2.0  # Seconds between progress log lines; tqdm shows live progress
+
+# Parallel upload settings
+UPLOAD_WORKERS = 8  # Threads upserting prepared batches concurrently
+QUEUE_SIZE = 4  # Prepared batches waiting for a worker; bounds memory use
+MAX_RETRIES = 3
+
+_ID_RE = re.compile(r'[^a-zA-Z0-9]')
+# Maps every ASCII character outside [a-zA-Z0-9] to an underscore
+_ID_TRANS = str.maketrans({c: '_' for c in map(chr, range(128)) if not c.isalnum()})
+
 def sanitize_id(id_str: str) -> str:
     """Sanitize ID to ensure it only contains ASCII characters."""
     # Replace non-alphanumeric characters with underscores
-    sanitized = re.sub(r'[^a-zA-Z0-9]', '_', id_str)
+    if id_str.isascii():
+        sanitized = id_str.translate(_ID_TRANS)
+    else:
+        sanitized = _ID_RE.sub('_', id_str)
     # Ensure the ID starts with a letter (Pinecone requirement)
     if not sanitized[0].isalpha():
         sanitized = 'id_' + sanitized
     return sanitized
 
-def convert_to_float_list(embedding: Union[List, Dict]) -> List[float]:
+def convert_to_float_list(embedding: Union[List, Dict, np.ndarray]) -> List[float]:
     """Convert embedding values to float type."""
+    if isinstance(embedding, np.ndarray):
+        return embedding.astype(float).tolist()
     if isinstance(embedding, dict):
         # Handle case where embedding might be a dictionary
         return [float(v) for v in embedding.values()]
     return [float(v) for v in embedding]
 
-def sanitize_metadata(metadata: Dict) -> Dict:
-    """Sanitize metadata values to ensure they are of valid types for Pinecone."""
+# Returned by metadata handlers for values that should be dropped
+_SKIP = object()
+
+def _keep(key: str, value):
+    return value
+
+def _drop(key: str, value):
+    return _SKIP
+
+def _sanitize_float(key: str, value: float):
+    # Handle NaN values by skipping them (NaN is the only value not equal to itself)
+    return _SKIP if value != value else value
+
+def _sanitize_number(key: str, value):
+    """Convert numpy floats and Decimals to Python numbers."""
+    if value != value:
+        return _SKIP
+    # Keep tokens as integer, convert other numeric fields to float
+    return int(value) if key == 'tokens' else float(value)
+
+def _sanitize_int(key: str, value):
+    return int(value)
+
+def _sanitize_list(key: str, value: list):
+    # Filter out None values from lists and convert remaining items
+    valid_items = [item for item in value if item is not None]
+    if not valid_items:  # Only include non-empty lists
+        return _SKIP
+    return [str(item) if not isinstance(item, (int, float, str, bool)) else item 
+            for item in valid_items]
+
+def _sanitize_other(key: str, value):
+    """Fallback for types without a handler, including subclasses of handled types."""
+    if isinstance(value, float):
+        return _sanitize_float(key, value)
+    if isinstance(value, (int, str)):
+        return value
+    if isinstance(value, list):
+        return _sanitize_list(key, value)
+    # Convert other types to string, but only if they have a value
+    str_value = str(value)
+    return str_value if str_value.strip() else _SKIP
+
+# Exact-type dispatch for sanitize_metadata; unknown types go through _sanitize_other
+_METADATA_HANDLERS = {
+    type(None): _drop,  # Skip null/None values entirely
+    str: _keep,
+    int: _keep,
+    bool: _keep,
+    float: _sanitize_float,
+    list: _sanitize_list,
+    Decimal: _sanitize_number,
+    np.float16: _sanitize_number,
+    np.float32: _sanitize_number,
+    np.float64: _sanitize_number,
+    np.int32: _sanitize_int,
+    np.int64: _sanitize_int,
+}
+
+def _sanitize_metadata_impl(metadata: Dict) -> Dict:
+    handlers = _METADATA_HANDLERS
     sanitized = {}
     for key, value in metadata.items():
-        # Skip null/None values entirely
-        if value is None:
-            continue
-            
-        if isinstance(value, (int, float, str, bool)):
-            # Handle NaN values by skipping them
-            if isinstance(value, float) and np.isnan(value):
-                continue
-                
-            # Convert numpy types to Python native types
-            if isinstance(value, (np.int64, np.int32)):
-                sanitized[key] = int(value)
-            elif isinstance(value, (np.float64, np.float32, Decimal)):
-                # Keep tokens as integer, convert other numeric fields to float
-                if key == 'tokens':
-                    sanitized[key] = int(value)
-                else:
-                    sanitized[key] = float(value)
-            else:
-                sanitized[key] = value
-        elif isinstance(value, list):
-            # Filter out None values from lists and convert remaining items
-            valid_items = [item for item in value if item is not None]
-            if valid_items:  # Only include non-empty lists
-                sanitized[key] = [str(item) if not isinstance(item, (int, float, str, bool)) else item 
-                                for item in valid_items]
-        else:
-            # Convert other types to string, but only if they have a value
-            str_value = str(value)
-            if str_value.strip():  # Only include non-empty strings
-                sanitized[key] = str_value
+        value = handlers.get(type(value), _sanitize_other)(key, value)
+        if value is not _SKIP:
+            sanitized[key] = value
     
     return sanitized
 
+def _freeze_value(value):
+    # Keep the type in the key: 1, 1.0 and True hash equal but sanitize differently
+    if type(value) is list:
+        return list, tuple((type(item), item) for item in value)
+    return type(value), value
+
+def _thaw_value(frozen):
+    value_type, value = frozen
+    if value_type is list:
+        return [item for _, item in value]
+    return value
+
+@lru_cache(maxsize=4096)
+def _sanitize_frozen_metadata(frozen: tuple) -> tuple:
+    # Cache list values as tuples so no caller can mutate a shared cached result
+    sanitized = _sanitize_metadata_impl({key: _thaw_value(value) for key, value in frozen})
+    return tuple((key, tuple(value) if type(value) is list else value) for key, value in sanitized.items())
+
+# Value types that sanitize_metadata passes through unchanged (exact types, so numpy subclasses still convert)
+_CLEAN_TYPES = frozenset((str, int, float, bool))
+
+def sanitize_metadata(metadata: Dict) -> Dict:
+    """Sanitize metadata values to ensure they are of valid types for Pinecone."""
+    # Already-clean metadata is returned as is; v != v is only true for NaN
+    if all(type(v) in _CLEAN_TYPES and v == v for v in metadata.values()):
+        return metadata
+    
+    # Chunks from the same restaurant repeat the same metadata, so cache by content
+    try:
+        frozen = tuple((key, _freeze_value(value)) for key, value in metadata.items())
+        hash(frozen)
+    except TypeError:
+        # Unhashable values such as nested dicts
+        return _sanitize_metadata_impl(metadata)
+    # Sanitized values are never tuples, so every tuple here was a list
+    return {key: list(value) if type(value) is tuple else value
+            for key, value in _sanitize_frozen_metadata(frozen)}
+
+_CANONICAL_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def _dumps_canonical(obj) -> bytes:
+    """Serialize to compact JSON with sorted keys, for hashing."""
+    return orjson.dumps(obj, option=_CANONICAL_OPTIONS, default=str)
+
 def generate_chunk_id(chunk: dict) -> str:
     """Generate a unique ID for a chunk based on its content."""
-    # Create a string combining text and metadata
-    content = chunk.get("text", "") + str(chunk.get("metadata", {}))
-    # Generate a hash
-    hash_id = hashlib.md5(content.encode()).hexdigest()
-    return f"chunk_{hash_id}"  # Ensure ID starts with a letter
+    # Hash text and metadata; sorted compact JSON keeps the metadata part order-independent
+    h = xxhash.xxh128()
+    h.update(chunk.get("text", "").encode())
+    h.update(_dumps_canonical(chunk.get("metadata", {})))
+    return f"chunk_{h.hexdigest()}"  # Ensure ID starts with a letter
 
 def verify_index_count(index) -> int:
     """Verify the number of vectors in the index."""
@@ -115,47 +217,95 @@ def clear_index(index) -> None:
         logging.error(f"Error clearing index: {str(e)}")
         raise
 
-def upload_batch(index, batch: list) -> Tuple[int, int, List[str]]:
-    """Upload a single batch of vectors to Pinecone."""
-    successful = 0
+def prepare_vectors(batch: list, seen_ids: Optional[set] = None) -> Tuple[list, int, List[str]]:
+    """Convert a batch of chunks to Pinecone Vectors for upserting, skipping ids in seen_ids."""
+    ids = []
+    raw_embeddings = []
+    metadatas = []
     failed = 0
     failed_ids = []
     
+    for chunk in batch:
+        try:
+            # Add ID if not present or sanitize existing ID
+            if "id" not in chunk:
+                chunk_id = generate_chunk_id(chunk)
+            else:
+                chunk_id = sanitize_id(chunk["id"])
+            
+            # Skip chunks whose id was already sent; upserting them again would only rewrite the same vector
+            if seen_ids is not None and chunk_id in seen_ids:
+                continue
+            
+            embedding = chunk["embedding"]
+            if isinstance(embedding, dict):
+                # Handle case where embedding might be a dictionary
+                embedding = list(embedding.values())
+            
+            # Sanitize metadata
+            metadata = sanitize_metadata(chunk["metadata"])
+        except Exception as e:
+            logging.error(f"Error processing chunk: {str(e)}")
+            failed += 1
+            failed_ids.append(chunk_id if 'chunk_id' in locals() else 'unknown')
+            continue
+        
+        # Only mark the id as seen once its chunk is prepared, so a later copy can stand in for a failed one
+        if seen_ids is not None:
+            seen_ids.add(chunk_id)
+        ids.append(chunk_id)
+        raw_embeddings.append(embedding)
+        metadatas.append(metadata)
+    
+    if not ids:
+        return [], failed, failed_ids
+    
     try:
-        vectors = []
-        for chunk in batch:
+        # Convert the whole batch as one matrix instead of building each float list in Python
+        matrix = np.asarray(raw_embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("embeddings have inconsistent dimensions")
+        embeddings = matrix.tolist()
+    except (ValueError, TypeError):
+        # Fall back to per-chunk conversion so only the malformed chunks fail
+        embeddings = []
+        for chunk_id, embedding in zip(ids, raw_embeddings):
             try:
-                # Add ID if not present or sanitize existing ID
-                if "id" not in chunk:
-                    chunk_id = generate_chunk_id(chunk)
-                else:
-                    chunk_id = sanitize_id(chunk["id"])
-                
-                # Convert embedding to float list
-                embedding = convert_to_float_list(chunk["embedding"])
-                
-                # Sanitize metadata
-                metadata = sanitize_metadata(chunk["metadata"])
-                
-                vectors.append((
-                    chunk_id,
-                    embedding,
-                    metadata
-                ))
+                embeddings.append(convert_to_float_list(embedding))
             except Exception as e:
                 logging.error(f"Error processing chunk: {str(e)}")
                 failed += 1
-                failed_ids.append(chunk_id if 'chunk_id' in locals() else 'unknown')
-                continue
-        
-        if vectors:
+                failed_ids.append(chunk_id)
+                embeddings.append(None)
+                if seen_ids is not None:
+                    seen_ids.discard(chunk_id)
+    
+    # Build the SDK's Vector objects here so upsert doesn't have to convert tuples
+    vectors = [
+        Vector(id=chunk_id, values=embedding, metadata=metadata)
+        for chunk_id, embedding, metadata in zip(ids, embeddings, metadatas)
+        if embedding is not None
+    ]
+    return vectors, failed, failed_ids
+
+def upsert_with_retry(index, vectors: list, max_retries: int = MAX_RETRIES, limiter: Optional[TokenBucket] = None) -> None:
+    """Upsert vectors, backing off exponentially between failed attempts."""
+    for attempt in range(max_retries):
+        if limiter:
+            limiter.acquire()
+        try:
             index.upsert(vectors=vectors)
-            successful = len(vectors)
-        
-        return successful, failed, failed_ids
-    except Exception as e:
-        logging.error(f"Error uploading batch: {str(e)}")
-        return 0, len(batch), [f"batch_{time.time()}"]
+            if limiter:
+                limiter.on_success()
+            return
+        except Exception as e:
+            if limiter and getattr(e, 'status', None) == 429:
+                limiter.on_throttle()
+            if attempt == max_retries - 1:
+                raise
+            delay = 2 ** attempt
+            logging.warning(f"Upsert failed ({str(e)}), retrying in {delay}s")
+            time.sleep(delay)
 
 def process_and_upload(pc: Pinecone, file_path: str, index_name: str = "restaurant-chatbot", batch_size: int = 100, should_clear: bool = False):
     """Process JSON file in chunks and upload to Pinecone."""
@@ -177,51 +327,121 @@ def process_and_upload(pc: Pinecone, file_path: str, index_name: str = "restaura
         # Process file in chunks
         successful_uploads = 0
         failed_uploads = 0
-        failed_chunk_ids = []
+        failed_chunk_ids = []  # Only the first few are kept in memory; all go to FAILED_IDS_FILE
+        failed_id_count = 0
         current_batch = []
         total_chunks = 0
         
-        # First, count total chunks
-        logging.info("Counting total chunks...")
-        with open(file_path, 'r', encoding='utf-8') as f:
-            chunks = json.load(f)
-            total_chunks = len(chunks)
+        # The main thread parses and prepares batches while worker threads upsert them,
+        # so file parsing and network round-trips overlap
+        batch_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        stats_lock = threading.Lock()
+        seen_ids = set()
+        duplicate_chunks = 0
+        next_log_at = 0.0
+        # Shared by all workers so the combined upsert rate adapts to Pinecone's limits
+        limiter = TokenBucket(rate=100.0, min_rate=1.0, max_rate=1000.0)
+        failed_ids_file = None  # Opened on the first failed id, so clean runs leave no file
         
-        logging.info(f"Found {total_chunks} chunks to process")
+        def record_failures(failed: int, failed_ids: List[str]):
+            nonlocal failed_uploads, failed_id_count, failed_ids_file
+            with stats_lock:
+                failed_uploads += failed
+                failed_id_count += len(failed_ids)
+                failed_chunk_ids.extend(failed_ids[:FAILED_IDS_TO_SHOW - len(failed_chunk_ids)])
+                if failed_ids and failed_ids_file is None:
+                    # Truncate so ids from earlier runs don't mix with this one's
+                    failed_ids_file = open(FAILED_IDS_FILE, 'wb')
+                for chunk_id in failed_ids:
+                    failed_ids_file.write(orjson.dumps({"id": chunk_id}) + b"\n")
         
-        # Process chunks with progress bar
-        with tqdm(total=total_chunks, desc="Uploading chunks") as pbar:
-            for chunk in chunks:
-                # Validate chunk has required fields
-                if not all(k in chunk for k in ["text", "embedding", "metadata"]):
-                    logging.warning(f"Skipping invalid chunk: missing required fields")
-                    failed_uploads += 1
-                    continue
-                
-                current_batch.append(chunk)
-                
-                if len(current_batch) >= batch_size:
-                    success, failed, failed_ids = upload_batch(index, current_batch)
-                    successful_uploads += success
-                    failed_uploads += failed
-                    failed_chunk_ids.extend(failed_ids)
-                    current_batch = []
-                    pbar.update(batch_size)
-                    
-                    # Log progress
-                    logging.info(f"Progress: {successful_uploads}/{total_chunks} chunks uploaded successfully")
-                    if failed_uploads > 0:
-                        logging.warning(f"Failed uploads so far: {failed_uploads}")
+        def upload_worker():
+            nonlocal successful_uploads, next_log_at
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    break
+                vectors, batch_len = item
+                try:
+                    upsert_with_retry(index, vectors, limiter=limiter)
+                except Exception as e:
+                    logging.error(f"Error uploading batch: {str(e)}")
+                    failed_ids = [vector.id for vector in vectors]
+                    # Let later copies of these chunks be uploaded instead of counted as duplicates
+                    seen_ids.difference_update(failed_ids)
+                    record_failures(len(vectors), failed_ids)
+                else:
+                    with stats_lock:
+                        successful_uploads += len(vectors)
+                with stats_lock:
+                    pbar.update(batch_len)
                     
-                    time.sleep(0.5)  # Rate limiting
+                    # Log progress at most every PROGRESS_LOG_INTERVAL seconds
+                    now = time.monotonic()
+                    if now >= next_log_at:
+                        next_log_at = now + PROGRESS_LOG_INTERVAL
+                        logging.info(f"Progress: {successful_uploads} chunks uploaded successfully ({total_chunks} read)")
+                        if failed_uploads > 0:
+                            logging.warning(f"Failed uploads so far: {failed_uploads}")
+        
+        def enqueue_batch(batch: list):
+            nonlocal duplicate_chunks
+            vectors, failed, failed_ids = prepare_vectors(batch, seen_ids)
+            record_failures(failed, failed_ids)
+            duplicate_chunks += len(batch) - len(vectors) - failed
+            if vectors:
+                batch_queue.put((vectors, len(batch)))
+            else:
+                with stats_lock:
+                    pbar.update(len(batch))
+        
+        # Chunks saved with --fp16-embeddings reference rows of a float16 side file;
+        # memory-map it so rows are only read when their batch is prepared
+        embeddings_file = os.path.splitext(file_path)[0] + '_embeddings.npy'
+        side_embeddings = np.load(embeddings_file, mmap_mode='r') if os.path.exists(embeddings_file) else None
+        if side_embeddings is not None:
+            logging.info(f"Reading embeddings from {embeddings_file}")
+        
+        # Stream chunks from the file instead of loading it all into memory;
+        # use_float avoids Decimal values that metadata sanitizing would stringify
+        # The file is memory-mapped so the OS pages it in on demand for the parser
+        with open(file_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                tqdm(desc="Uploading chunks", unit="chunk") as pbar:
+            workers = [threading.Thread(target=upload_worker, daemon=True) for _ in range(UPLOAD_WORKERS)]
+            for worker in workers:
+                worker.start()
             
-            # Upload any remaining chunks
-            if current_batch:
-                success, failed, failed_ids = upload_batch(index, current_batch)
-                successful_uploads += success
-                failed_uploads += failed
-                failed_chunk_ids.extend(failed_ids)
-                pbar.update(len(current_batch))
+            try:
+                for chunk in ijson.items(mm, 'item', use_float=True):
+                    total_chunks += 1
+                    if "embedding" not in chunk and "embedding_id" in chunk and side_embeddings is not None:
+                        # Upcast happens when the batch matrix is built in prepare_vectors
+                        chunk["embedding"] = side_embeddings[chunk["embedding_id"]]
+                    
+                    # Validate chunk has required fields
+                    if not all(k in chunk for k in ["text", "embedding", "metadata"]):
+                        logging.warning(f"Skipping invalid chunk: missing required fields")
+                        record_failures(1, [])
+                        continue
+                    
+                    current_batch.append(chunk)
+                    
+                    if len(current_batch) >= batch_size:
+                        enqueue_batch(current_batch)
+                        current_batch = []
+                
+                # Upload any remaining chunks
+                if current_batch:
+                    enqueue_batch(current_batch)
+            finally:
+                # Let the workers drain the queue, then stop them
+                for _ in workers:
+                    batch_queue.put(None)
+                for worker in workers:
+                    worker.join()
+                if failed_ids_file is not None:
+                    failed_ids_file.close()
         
         # Verify final count
         final_count = verify_index_count(index)
@@ -229,19 +449,21 @@ def process_and_upload(pc: Pinecone, file_path: str, index_name: str = "restaura
         logging.info(f"- Total chunks processed: {total_chunks}")
         logging.info(f"- Successfully uploaded: {successful_uploads} chunks")
         logging.info(f"- Failed to upload: {failed_uploads} chunks")
+        logging.info(f"- Skipped duplicate ids: {duplicate_chunks} chunks")
         logging.info(f"- Initial vector count: {initial_count}")
         logging.info(f"- Final vector count: {final_count}")
         logging.info(f"- Net change: {final_count - initial_count} vectors")
         
         if failed_chunk_ids:
-            logging.warning("Failed chunk IDs:")
-            for chunk_id in failed_chunk_ids[:10]:  # Show first 10 failed IDs
+            logging.warning(f"Failed chunk IDs (all written to {FAILED_IDS_FILE}):")
+            for chunk_id in failed_chunk_ids:  # Show first 10 failed IDs
                 logging.warning(f"- {chunk_id}")
-            if len(failed_chunk_ids) > 10:
-                logging.warning(f"... and {len(failed_chunk_ids) - 10} more")
+            if failed_id_count > len(failed_chunk_ids):
+                logging.warning(f"... and {failed_id_count - len(failed_chunk_ids)} more")
         
-        if final_count != total_chunks and not should_clear:
-            logging.warning(f"WARNING: Final count ({final_count}) does not match total chunks ({total_chunks})")
+        unique_chunks = total_chunks - duplicate_chunks
+        if final_count != unique_chunks and not should_clear:
+            logging.warning(f"WARNING: Final count ({final_count}) does not match unique chunks ({unique_chunks})")
             
     except Exception as e:
         logging.error(f"Error during processing: {str(e)}")
@@ -24,19 +24,72 @@ def convert_to_native_types(obj: Any) -> Any:
         obj: Any object that might contain numpy types
         
     Returns:
-        The same object with numpy types converted to Python native types
+        A copy of the object, with new dicts/lists and numpy types converted to Python native types
     """
-    if isinstance(obj, dict):
-        return {key: convert_to_native_types(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_to_native_types(item) for item in obj]
-    elif isinstance(obj, (np.integer, np.floating)):
+    # Top-level leaves (e.g. a whole embedding array) convert in a single call
+    converter = _LEAF_CONVERTERS.get(type(obj))
+    if converter is not None:
+        return converter(obj)
+    
+    # Walk nested dicts/lists with an explicit stack instead of recursion; each entry
+    # is (parent container, key in parent, value) and the result is written back in place
+    root = [obj]
+    stack = [(root, 0, obj)]
+    while stack:
+        parent, key, value = stack.pop()
+        # Containers are always copied, even when already clean, so the result never aliases the input
+        if isinstance(value, dict):
+            converted = dict(value)
+        elif isinstance(value, list):
+            converted = list(value)
+        else:
+            converter = _LEAF_CONVERTERS.get(type(value))
+            parent[key] = converter(value) if converter is not None else _convert_other_leaf(value)
+            continue
+        
+        parent[key] = converted
+        children = converted.items() if isinstance(converted, dict) else enumerate(converted)
+        stack.extend((converted, k, v) for k, v in children if type(v) not in _NATIVE_SCALARS)
+    return root[0]
+
+def _convert_other_leaf(obj: Any) -> Any:
+    """Fallback for leaf types without an exact converter, e.g. numpy bools and scalar subclasses"""
+    if isinstance(obj, np.generic):
         return obj.item()
     elif isinstance(obj, np.ndarray):
         return obj.tolist()
     else:
         return obj
 
+# Leaf types that never need converting
+_NATIVE_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+# Exact-type dispatch for non-container values; anything else goes through _convert_other_leaf
+_LEAF_CONVERTERS = {np.ndarray: np.ndarray.tolist}
+for _native_type in _NATIVE_SCALARS:
+    _LEAF_CONVERTERS[_native_type] = lambda obj: obj
+for _np_type in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64,
+                 np.float16, np.float32, np.float64):
+    _LEAF_CONVERTERS[_np_type] = _np_type.item
+
+def embedding_to_list(embedding: Any) -> List[float]:
+    """
+    Convert an embedding to a list of Python floats without walking it element by element
+    
+    Args:
+        embedding: numpy array or list of floats
+        
+    Returns:
+        List of Python floats
+    """
+    if isinstance(embedding, np.ndarray):
+        # Single C-level conversion; Pinecone stores float32 anyway
+        return embedding.astype(np.float32, copy=False).tolist()
+    if isinstance(embedding, list) and (not embedding or type(embedding[0]) is float):
+        # Already native floats, nothing to convert
+        return embedding
+    return convert_to_native_types(embedding)
+
 @dataclass
 class SearchResult:
     """Class to represent a search result"""
@@ -60,8 +113,7 @@ def init_pinecone() -> Optional[pinecone.Index]:
         pc = Pinecone(api_key=api_key)
         
         # Check if index exists
-        indexes = pc.list_indexes()
-        if not any(idx.name == INDEX_NAME for idx in indexes):
+        if INDEX_NAME not in set(pc.list_indexes().names()):
             # Create index if it doesn't exist
             pc.create_index(
                 name=INDEX_NAME,
@@ -102,18 +154,22 @@ def upsert_embeddings(index: pinecone.Index, chunks: List[EmbeddedChunk], batch_
             batch = chunks[i:i + batch_size]
             
             # Convert embeddings to native Python types
-            vectors = []
-            for chunk in batch:
-                vector = convert_to_native_types(chunk.embedding)
-                metadata = {
-                    "text": chunk.text,
-                    "type": chunk.metadata.get("type", "unknown"),
-                    "restaurant_id": chunk.metadata.get("restaurant_id", "unknown"),
-                    "restaurant_name": chunk.metadata.get("restaurant_name", "unknown"),
-                    "category": chunk.metadata.get("category", "unknown"),
-                    "timestamp": time.time()
-                }
-                vectors.append((str(chunk.id), vector, metadata))
+            timestamp = time.time()  # One timestamp per batch
+            vectors = [
+                (
+                    str(chunk.id),
+                    embedding_to_list(chunk.embedding),
+                    {
+                        "text": chunk.text,
+                        "type": chunk.metadata.get("type", "unknown"),
+                        "restaurant_id": chunk.metadata.get("restaurant_id", "unknown"),
+                        "restaurant_name": chunk.metadata.get("restaurant_name", "unknown"),
+                        "category": chunk.metadata.get("category", "unknown"),
+                        "timestamp": timestamp
+                    }
+                )
+                for chunk in batch
+            ]
             
             # Upsert batch
             index.upsert(vectors=vectors)
@@ -145,9 +201,9 @@ def query_similar(
         List of similar vectors with their metadata and scores
     """
     try:
-        # Query the index
+        # Query the index; Pinecone only accepts a plain list of floats
         results = index.query(
-            vector=query_embedding,
+            vector=embedding_to_list(query_embedding),
             top_k=top_k,
             include_metadata=True,
             filter=filter
@@ -226,7 +282,7 @@ if __name__ == "__main__":
                 
                 # Verify the upsert by querying the first vector
                 print("\n=== Verifying Upsert with Query ===")
-                first_embedding = convert_to_native_types(test_embeddings[0].embedding)
+                first_embedding = embedding_to_list(test_embeddings[0].embedding)
                 results = query_similar(index, first_embedding, top_k=1)
                 
                 if results:
@@ -1,56 +1,256 @@
 import os
+import shutil
 import pytest
-import asyncio
-from fastapi.testclient import TestClient
-from src.api.main import app
+import sys
+import operator
+from itertools import compress
+from typing import Any, Callable, Dict, List
+from types import SimpleNamespace
+from unittest.mock import patch
+import numpy as np
+
+try:
+    import uvloop
+except ImportError:  # Keep pytest-asyncio's default event loop
+    uvloop = None
 
 # Test client fixture
-@pytest.fixture(autouse=True)
+@pytest.fixture(autouse=True, scope="session")
 def setup_test_environment():
-    """Set up test environment variables before each test"""
-    os.environ["OPENAI_API_KEY"] = "test-key"
-    os.environ["PINECONE_API_KEY"] = "test-key"
-    os.environ["PINECONE_ENVIRONMENT"] = "test-env"
-    yield
-    # Clean up after tests
-    os.environ.pop("OPENAI_API_KEY", None)
-    os.environ.pop("PINECONE_API_KEY", None)
-    os.environ.pop("PINECONE_ENVIRONMENT", None)
+    """Set up test environment variables once for the whole test session"""
+    # The context restores the original values once the session ends
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("OPENAI_API_KEY", "test-key")
+        mp.setenv("PINECONE_API_KEY", "test-key")
+        mp.setenv("PINECONE_ENVIRONMENT", "test-env")
+        yield
 
-@pytest.fixture
-def test_client():
-    """Create a test client for the FastAPI app"""
+@pytest.fixture(scope="session")
+def app():
+    """The FastAPI app, imported on first use so unit-only runs don't need the API stack"""
+    from src.api.main import app
+    return app
+
+@pytest.fixture(scope="session")
+def test_client(app):
+    """Create a test client for the FastAPI app, shared across the session"""
+    from fastapi.testclient import TestClient
     return TestClient(app)
 
-# Mock data fixtures
-@pytest.fixture
-def sample_restaurant_data():
-    """Sample restaurant data for testing"""
-    return {
-        "restaurant_name": "Test Restaurant",
-        "rating": 4.5,
-        "price_range": "$$",
-        "cuisine_type": "Test Cuisine",
-        "description": "A test restaurant description"
-    }
+@pytest.fixture(scope="session")
+def xdist_worker(request):
+    """Name of the pytest-xdist worker, or "master" when running without xdist"""
+    return getattr(request.config, "workerinput", {}).get("workerid", "master")
+
+@pytest.fixture(scope="session")
+def _patch_similar_chunks(app):
+    """Replace the API's vector search once for the whole session; requested by API tests only"""
+    with patch("src.api.main.get_similar_chunks") as mock_search:
+        # Match the real search when no index is reachable
+        mock_search.return_value = []
+        yield mock_search
 
 @pytest.fixture
-def sample_menu_item():
-    """Sample menu item data for testing"""
-    return {
-        "item_name": "Test Item",
-        "restaurant_name": "Test Restaurant",
-        "category": "Test Category",
-        "description": "A test menu item description",
-        "price": 9.99
-    }
+def patched_similar_chunks(_patch_similar_chunks):
+    """The session-wide vector search mock, reset after each test"""
+    yield _patch_similar_chunks
+    _patch_similar_chunks.reset_mock()
+    _patch_similar_chunks.side_effect = None
+
+@pytest.fixture(scope="session")
+def storage_dir(tmp_path_factory, xdist_worker):
+    """Conversation storage directory shared across the session"""
+    return tmp_path_factory.mktemp(f"convos_{xdist_worker}")
+
+@pytest.fixture(scope="session")
+def mgr(storage_dir):
+    """Conversation manager used by the chat and API modules for the whole session"""
+    from src.conversation import ConversationManager
+    manager = ConversationManager(str(storage_dir))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("src.chat.conversation_manager", manager)
+        mp.setattr("src.api.main.conversation_manager", manager)
+        yield manager
 
 @pytest.fixture
+def reset_mgr(mgr, storage_dir):
+    """Provide the shared conversation manager and empty it after the test"""
+    yield mgr
+    mgr.conversations.clear()
+    shutil.rmtree(storage_dir, ignore_errors=True)
+    storage_dir.mkdir(parents=True, exist_ok=True)
+
+# Mock data fixtures
+@pytest.fixture(scope="session")
 def mock_embedding():
-    """Sample embedding vector for testing"""
-    import numpy as np
-    # Generate a random embedding vector of the correct dimension
-    return list(np.random.rand(1536).astype(float))
+    """Sample embedding vector for testing, generated once per session (treat as read-only)"""
+    # Generate a seeded random embedding vector of the correct dimension
+    rng = np.random.default_rng(0)
+    return rng.random(1536, dtype=np.float32).tolist()
+
+class CallSpy:
+    """Callable returning a fixed value and recording its calls, without Mock overhead"""
+    def __init__(self, return_value=None, side_effect=None):
+        self.return_value = return_value
+        self.side_effect = side_effect  # Raised instead of returning when set
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        if self.side_effect is not None:
+            raise self.side_effect
+        return self.return_value
+
+    @property
+    def call_count(self) -> int:
+        return len(self.calls)
+
+    @property
+    def last_kwargs(self):
+        return self.calls[-1][1] if self.calls else None
+
+@pytest.fixture(scope="session")
+def call_spy():
+    """The CallSpy class, for tests that need lightweight call recording"""
+    return CallSpy
+
+_MISSING = object()
+
+# Pinecone metadata filter operators supported by the mock index
+_FILTER_OPS = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$in": lambda field, values: field in values,
+    "$nin": lambda field, values: field not in values,
+}
+
+def _compile_filter(filter_dict: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """Turn a Pinecone metadata filter into a predicate, walking the filter dict only once"""
+    checks = tuple(
+        (key, _FILTER_OPS[op], value)
+        for key, cond in filter_dict.items()
+        for op, value in (cond.items() if isinstance(cond, dict) else [("$eq", cond)])
+    )
+    
+    def matches(metadata: Dict[str, Any]) -> bool:
+        for key, op, value in checks:
+            field = metadata.get(key, _MISSING)
+            if field is _MISSING or not op(field, value):
+                return False
+        return True
+    
+    return matches
+
+class MockPineconeIndex:
+    """In-memory NumPy index speaking the protocol src.vector_db uses with Pinecone"""
+    def __init__(self, dimension: int = 1536):
+        self.vectors = {}
+        self.dimension = dimension
+        self.name = "restaurant-chatbot"
+        # Stats returned by each describe_index_stats call, in order
+        self.stats_calls: List[Dict[str, Any]] = []
+        # Vectors stored row-wise for scoring; row i belongs to self._ids[i]
+        self._ids: List[str] = []
+        self._meta: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._buf = np.empty((0, self.dimension), dtype=np.float32)
+        
+    @property
+    def _mat(self) -> np.ndarray:
+        return self._buf[:len(self._ids)]
+        
+    def describe_index_stats(self):
+        stats = {
+            "dimension": self.dimension,
+            "total_vector_count": len(self._ids),
+            "namespaces": {}
+        }
+        self.stats_calls.append(stats)
+        return stats
+        
+    def upsert(self, vectors: List[Any]):
+        # upsert_embeddings sends (id, values, metadata) tuples; dicts are accepted too
+        vectors = [
+            (v["id"], v["values"], v.get("metadata", {})) if isinstance(v, dict) else tuple(v)
+            for v in vectors
+        ]
+        new_ids = [vid for vid, _, _ in vectors if vid not in self._rows]
+        needed = len(self._ids) + len(set(new_ids))
+        if needed > len(self._buf):
+            # Grow geometrically so repeated upserts copy the matrix O(log N) times
+            grown = np.empty((max(needed, 2 * len(self._buf)), self.dimension), dtype=np.float32)
+            grown[:len(self._ids)] = self._mat
+            self._buf = grown
+        for vid, values, metadata in vectors:
+            if vid not in self._rows:
+                self._rows[vid] = len(self._ids)
+                self._ids.append(vid)
+                self._meta.append(metadata)
+            row = self._rows[vid]
+            self._buf[row] = values
+            self._meta[row] = metadata
+            self.vectors[vid] = {
+                "values": values,
+                "metadata": metadata
+            }
+            
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = True, filter: Dict = None):
+        # Cosine similarity against all stored vectors in one matrix product
+        n = len(self._ids)
+        if not n or top_k <= 0:
+            return SimpleNamespace(matches=[])
+        mat = self._mat
+        q = np.asarray(vector, dtype=np.float32)
+        scores = mat @ q / (np.linalg.norm(mat, axis=1) * np.linalg.norm(q) + 1e-12)
+        candidates = np.arange(n)
+        if filter:
+            candidates = candidates[self._build_filter_mask(filter)]
+        k = min(top_k, len(candidates))
+        if not k:
+            return SimpleNamespace(matches=[])
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return SimpleNamespace(matches=[
+            SimpleNamespace(
+                id=self._ids[i],
+                score=float(scores[i]),
+                metadata=self._meta[i] if include_metadata else None
+            )
+            for i in top
+        ])
+        
+    def _build_filter_mask(self, filter_dict: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask over stored rows whose metadata matches the filter"""
+        return np.fromiter(map(_compile_filter(filter_dict), self._meta), dtype=bool, count=len(self._ids))
+        
+    def delete(self, ids: List[str] = None, filter: Dict = None):
+        """Mock delete operation"""
+        if ids:
+            drop = set(ids)
+            mask = np.fromiter((vid in drop for vid in self._ids), dtype=bool, count=len(self._ids))
+        elif filter:
+            mask = self._build_filter_mask(filter)
+        else:
+            return
+        if not mask.any():
+            return
+        # Slice the kept rows out in one pass instead of rebuilding from self.vectors
+        keep = ~mask
+        self._buf = self._mat[keep]
+        for vid in compress(self._ids, mask):
+            del self.vectors[vid]
+        self._ids = list(compress(self._ids, keep))
+        self._meta = list(compress(self._meta, keep))
+        self._rows = {vid: row for row, vid in enumerate(self._ids)}
+
+@pytest.fixture(scope="session")
+def mock_index_factory():
+    """The MockPineconeIndex class; call it for a fresh, empty index"""
+    return MockPineconeIndex
 
 # Environment setup
 def pytest_configure(config):
@@ -60,8 +260,10 @@ def pytest_configure(config):
     os.environ.setdefault("PINECONE_API_KEY", "test_key")
     os.environ.setdefault("PINECONE_ENVIRONMENT", "test")
 
-@pytest.fixture(scope="session")
-def event_loop():
-    loop = asyncio.get_event_loop()
-    yield loop
-    loop.close() 
\ No newline at end of file
+# Run async tests on uvloop where it is installed (it does not support Windows);
+# otherwise pytest-asyncio's default event loop is used
+if uvloop is not None and sys.platform != "win32":
+    @pytest.fixture(scope="session")
+    def event_loop_policy():
+        """Use uvloop's event loop policy for async tests"""
+        return uvloop.EventLoopPolicy()
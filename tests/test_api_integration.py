@@ -10,71 +10,59 @@ These tests verify the complete chat flow, including:
 """
 
 import pytest
-import time
-from pathlib import Path
-import shutil
-from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
-from src.api.main import app
-from src.api.models import (
-    QueryRequest,
-    QueryResponse,
-    ChatRequest,
-    ChatResponse,
-    RestaurantSearchRequest,
-    RestaurantSearchResponse,
-    ErrorResponse,
-    Message,
-    Conversation,
-    ConversationMetadata
-)
-from src.chat import conversation_manager
-from openai import OpenAI
+import pytest_asyncio
+from types import SimpleNamespace
+from unittest.mock import Mock
+from pinecone import Index
 import httpx
+from limits import parse
 import json
-import os
-from openai.types.chat import ChatCompletion, ChatCompletionMessage
-from tempfile import TemporaryDirectory
 from src.api.dependencies import get_openai_client, get_pinecone_client
-from src.conversation import conversation_manager, ConversationManager
-from fastapi.responses import JSONResponse
+from src.api.main import CHAT_RATE_LIMIT, CONVERSATION_RATE_LIMIT, CLEANUP_RATE_LIMIT
 
-@pytest.fixture
-def mock_rate_limit():
-    """Disable rate limiting for tests"""
-    with patch("src.api.main.RATE_LIMIT_SECONDS", 0):
-        yield
+# Vector search results served by mock_vector_search, built once (treat as read-only)
+SEARCH_RESULTS = [
+    {
+        "metadata": {
+            "text": "Test Restaurant is a popular dining spot known for its excellent service and diverse menu.",
+            "type": "restaurant_overview",
+            "restaurant_name": "Test Restaurant",
+            "rating": 4.5,
+            "price_range": "$$",
+            "restaurant_id": "123"
+        },
+        "score": 0.95
+    }
+]
 
-@pytest.fixture(autouse=True)
-def mock_env():
-    """Mock environment variables"""
-    with patch.dict(os.environ, {
-        "OPENAI_API_KEY": "test-key",
-        "PINECONE_API_KEY": "test-key",
-        "PINECONE_ENVIRONMENT": "test-env"
-    }):
-        yield
+pytestmark = [
+    pytest.mark.e2e,
+    pytest.mark.asyncio(loop_scope="session"),
+    pytest.mark.usefixtures("_patch_similar_chunks", "test_storage_dir", "reset_mgr"),
+]
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_openai():
-    """Create a mock OpenAI client"""
-    mock_client = MagicMock()
-    mock_client.chat.completions.create.return_value = MagicMock(
+    """Create a mock OpenAI client shared across the session"""
+    # The client's resources are instance attributes, so only the entry point is specced
+    mock_client = Mock(spec=["chat"])
+    mock_client.chat.completions.create.return_value = SimpleNamespace(
         choices=[
-            MagicMock(
-                message=MagicMock(
+            SimpleNamespace(
+                message=SimpleNamespace(
                     content="This is a test response"
                 )
             )
-        ]
+        ],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
     )
     return mock_client
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_pinecone():
-    """Create a mock Pinecone client"""
-    mock_client = MagicMock()
-    mock_client.query.return_value = MagicMock(
+    """Create a mock Pinecone client shared across the session"""
+    mock_client = Mock(spec=Index)
+    mock_client.query.return_value = SimpleNamespace(
         matches=[
             {
                 "id": "test_id",
@@ -90,32 +78,17 @@ def mock_pinecone():
     )
     return mock_client
 
-@pytest.fixture
-def mock_http_client():
-    """Mock HTTP client"""
-    mock_client = MagicMock()
-    mock_client.headers = {"Authorization": "Bearer test-key"}
-    mock_client.post.return_value = MagicMock(status_code=200)
-    return mock_client
+@pytest.fixture(autouse=True)
+def _reset_mocks(mock_openai, mock_pinecone):
+    """Clear recorded calls on the shared client mocks, keeping their canned responses"""
+    yield
+    mock_openai.reset_mock(return_value=False, side_effect=False)
+    mock_pinecone.reset_mock(return_value=False, side_effect=False)
 
-@pytest.fixture
-def test_storage_dir():
-    """Create a temporary directory for conversation storage"""
-    with TemporaryDirectory() as temp_dir:
-        storage_dir = Path(temp_dir) / "test_conversations"
-        storage_dir.mkdir(parents=True, exist_ok=True)
-        # Create a new conversation manager with the test storage directory
-        global conversation_manager
-        conversation_manager = ConversationManager(str(storage_dir))
-        # Ensure the storage directory is set correctly
-        assert conversation_manager.storage_dir == storage_dir
-        # Update the conversation manager in the chat module
-        import src.chat
-        src.chat.conversation_manager = conversation_manager
-        # Update the conversation manager in the API module
-        import src.api.main
-        src.api.main.conversation_manager = conversation_manager
-        yield storage_dir
+@pytest.fixture(scope="session")
+def test_storage_dir(storage_dir, mgr):
+    """Session conversation storage, with the shared manager installed"""
+    return storage_dir
 
 @pytest.fixture
 def mock_vector_search():
@@ -126,59 +99,51 @@ def mock_vector_search():
             return []
             
         # For other tests, return the test restaurant data
-        return [
-            {
-                "metadata": {
-                    "text": "Test Restaurant is a popular dining spot known for its excellent service and diverse menu.",
-                    "type": "restaurant_overview",
-                    "restaurant_name": "Test Restaurant",
-                    "rating": 4.5,
-                    "price_range": "$$",
-                    "restaurant_id": "123"
-                },
-                "score": 0.95
-            }
-        ]
+        return SEARCH_RESULTS
     return mock_search
 
-@pytest.fixture
-def test_client(test_storage_dir, mock_openai, mock_pinecone):
-    """Create a test client with mocked dependencies"""
-    # Set up test app
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def async_client(app):
+    """Create an in-process async client once for the whole test session"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+@pytest.fixture(autouse=True)
+def dependency_overrides(app, mock_openai, mock_pinecone):
+    """Point the app dependencies at this test's mocked clients"""
     app.dependency_overrides[get_openai_client] = lambda: mock_openai
     app.dependency_overrides[get_pinecone_client] = lambda: mock_pinecone
-    
-    # Create test client
-    client = TestClient(app)
-    
-    yield client
-    
-    # Cleanup
-    conversation_manager.conversations = {}
-    if test_storage_dir.exists():
-        for file in test_storage_dir.glob("*.json"):
-            file.unlink()
+    yield
+    app.dependency_overrides.clear()
+
+@pytest.fixture(autouse=True)
+def reset_state(app):
+    """Clear rate limit counters between tests"""
+    yield
+    import src.api.dependencies
+    app.state.limiter.reset()
+    src.api.dependencies.limiter.reset()
 
-def test_query_endpoint_success(test_client, mock_vector_search):
+async def test_query_endpoint_success(async_client, patched_similar_chunks, mock_vector_search):
     """Test successful query processing"""
-    with patch("src.api.main.get_similar_chunks", mock_vector_search):
-        response = test_client.post(
-            "/api/v1/query",
-            json={"query": "Tell me about Test Restaurant"}
-        )
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert "results" in data
-        assert len(data["results"]) > 0
-        result = data["results"][0]
-        assert result["restaurant"] == "Test Restaurant"
-        assert result["rating"] == "4.5"
-        assert result["price_range"] == "$$"
+    patched_similar_chunks.side_effect = mock_vector_search
+    response = await async_client.post(
+        "/api/v1/query",
+        json={"query": "Tell me about Test Restaurant"}
+    )
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert "results" in data
+    assert len(data["results"]) > 0
+    result = data["results"][0]
+    assert result["restaurant"] == "Test Restaurant"
+    assert result["rating"] == "4.5"
+    assert result["price_range"] == "$$"
 
-def test_query_endpoint_empty_query(test_client):
+async def test_query_endpoint_empty_query(async_client):
     """Test query endpoint with empty query"""
-    response = test_client.post(
+    response = await async_client.post(
         "/api/v1/query",
         json={"query": ""}
     )
@@ -187,27 +152,27 @@ def test_query_endpoint_empty_query(test_client):
     data = response.json()
     assert "detail" in data
 
-def test_chat_endpoint_success(test_client, mock_openai, mock_vector_search):
+async def test_chat_endpoint_success(async_client, mock_openai, patched_similar_chunks, mock_vector_search):
     """Test successful chat completion"""
-    with patch("src.api.main.get_similar_chunks", mock_vector_search):
-        response = test_client.post(
-            "/api/v1/chat",
-            json={
-                "query": "What's good at Test Restaurant?",
-                "conversation_id": "test_convo"
-            }
-        )
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert "response" in data
-        assert "conversation_id" in data
-        assert data["conversation_id"] == "test_convo"
+    patched_similar_chunks.side_effect = mock_vector_search
+    response = await async_client.post(
+        "/api/v1/chat",
+        json={
+            "query": "What's good at Test Restaurant?",
+            "conversation_id": "test_convo"
+        }
+    )
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert "response" in data
+    assert "conversation_id" in data
+    assert data["conversation_id"] == "test_convo"
 
-def test_chat_endpoint_with_history(test_client, mock_openai):
+async def test_chat_endpoint_with_history(async_client, mock_openai):
     """Test chat endpoint with conversation history"""
     # First message
-    response1 = test_client.post(
+    response1 = await async_client.post(
         "/api/v1/chat",
         json={
             "query": "Tell me about Test Restaurant",
@@ -217,7 +182,7 @@ def test_chat_endpoint_with_history(test_client, mock_openai):
     assert response1.status_code == 200
     
     # Second message in same conversation
-    response2 = test_client.post(
+    response2 = await async_client.post(
         "/api/v1/chat",
         json={
             "query": "What are their popular dishes?",
@@ -227,15 +192,15 @@ def test_chat_endpoint_with_history(test_client, mock_openai):
     assert response2.status_code == 200
     
     # Verify both messages are in conversation
-    response3 = test_client.get("/api/v1/conversations/recent")
+    response3 = await async_client.get("/api/v1/conversations/recent")
     assert response3.status_code == 200
     conversations = response3.json()
     assert len(conversations) > 0
     assert len(conversations[0]["messages"]) == 4  # 2 user messages + 2 assistant responses
 
-def test_restaurants_endpoint_success(test_client):
+async def test_restaurants_endpoint_success(async_client):
     """Test successful restaurant search"""
-    response = test_client.post(
+    response = await async_client.post(
         "/api/v1/restaurants",
         json={
             "query": "Italian restaurants",
@@ -253,9 +218,9 @@ def test_restaurants_endpoint_success(test_client):
     assert "page" in data
     assert "page_size" in data
 
-def test_restaurants_endpoint_invalid_params(test_client):
+async def test_restaurants_endpoint_invalid_params(async_client):
     """Test restaurant search with invalid parameters"""
-    response = test_client.post(
+    response = await async_client.post(
         "/api/v1/restaurants",
         json={
             "query": "Italian restaurants",
@@ -270,27 +235,33 @@ def test_restaurants_endpoint_invalid_params(test_client):
     data = response.json()
     assert "detail" in data
 
-def test_rate_limiting(test_client):
+# Request bodies reused by the rate limit loops, serialized once
+CHAT_PAYLOAD = json.dumps({"query": "Test query", "conversation_id": "test_convo"}).encode()
+CLEANUP_PAYLOAD = json.dumps({"days_old": 30}).encode()
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _limit_amount(limit: str) -> int:
+    """Number of requests allowed by a rate limit string such as '30/minute'"""
+    return parse(limit).amount
+
+async def test_rate_limiting(async_client):
     """Test rate limiting middleware"""
     # Make multiple requests to exceed rate limit
-    responses = []
-    for _ in range(35):  # Exceeds the 30/minute limit
-        response = test_client.post(
+    last_429 = None
+    for _ in range(_limit_amount(CHAT_RATE_LIMIT) + 5):
+        response = await async_client.post(
             "/api/v1/chat",
-            json={
-                "query": "Test query",
-                "conversation_id": "test_convo"
-            }
+            content=CHAT_PAYLOAD,
+            headers=JSON_HEADERS
         )
-        responses.append(response)
-        time.sleep(0.01)  # Small delay to avoid overwhelming the test server
+        if response.status_code == 429:
+            last_429 = response
+            break
     
-    # Count rate limited responses
-    rate_limited = [r for r in responses if r.status_code == 429]
-    assert len(rate_limited) > 0
+    assert last_429 is not None
     
     # Verify rate limit response format
-    rate_limited_response = rate_limited[0].json()
+    rate_limited_response = last_429.json()
     assert "detail" in rate_limited_response
     detail = rate_limited_response["detail"]
     assert detail["error"] == "rate_limit_exceeded"
@@ -298,13 +269,10 @@ def test_rate_limiting(test_client):
     assert detail["endpoint_type"] == "chat"
     assert detail["retry_after"] == 30
 
-def test_error_handling(test_client, mock_openai):
+async def test_error_handling(async_client, mock_openai):
     """Test error handling middleware"""
-    # Reset rate limit state by creating a new storage
-    test_client.app.state.limiter._storage._storage = {}
-    
     # Simulate an error by passing invalid data
-    response = test_client.post(
+    response = await async_client.post(
         "/api/v1/chat",
         json={"invalid": "data"}
     )
@@ -313,27 +281,24 @@ def test_error_handling(test_client, mock_openai):
     error_response = response.json()
     assert "detail" in error_response
 
-def test_rate_limiting_chat_endpoint(test_client):
+async def test_rate_limiting_chat_endpoint(async_client):
     """Test rate limiting specifically for chat endpoints"""
     # Make multiple requests to chat endpoint
-    responses = []
-    for _ in range(35):  # Exceeds the 30/minute limit
-        response = test_client.post(
+    last_429 = None
+    for _ in range(_limit_amount(CHAT_RATE_LIMIT) + 5):
+        response = await async_client.post(
             "/api/v1/chat",
-            json={
-                "query": "Test query",
-                "conversation_id": "test_convo"
-            }
+            content=CHAT_PAYLOAD,
+            headers=JSON_HEADERS
         )
-        responses.append(response)
-        time.sleep(0.01)  # Small delay to avoid overwhelming the test server
+        if response.status_code == 429:
+            last_429 = response
+            break
     
-    # Count rate limited responses
-    rate_limited = [r for r in responses if r.status_code == 429]
-    assert len(rate_limited) > 0
+    assert last_429 is not None
     
     # Verify rate limit response format
-    rate_limited_response = rate_limited[0].json()
+    rate_limited_response = last_429.json()
     assert "detail" in rate_limited_response
     detail = rate_limited_response["detail"]
     assert detail["error"] == "rate_limit_exceeded"
@@ -341,21 +306,20 @@ def test_rate_limiting_chat_endpoint(test_client):
     assert detail["endpoint_type"] == "chat"
     assert detail["retry_after"] == 30
 
-def test_rate_limiting_conversation_endpoint(test_client):
+async def test_rate_limiting_conversation_endpoint(async_client):
     """Test rate limiting for conversation management endpoints"""
     # Make multiple requests to get recent conversations
-    responses = []
-    for _ in range(65):  # Exceeds the 60/minute limit
-        response = test_client.get("/api/v1/conversations/recent")
-        responses.append(response)
-        time.sleep(0.01)  # Small delay to avoid overwhelming the test server
+    last_429 = None
+    for _ in range(_limit_amount(CONVERSATION_RATE_LIMIT) + 5):
+        response = await async_client.get("/api/v1/conversations/recent")
+        if response.status_code == 429:
+            last_429 = response
+            break
     
-    # Count rate limited responses
-    rate_limited = [r for r in responses if r.status_code == 429]
-    assert len(rate_limited) > 0
+    assert last_429 is not None
     
     # Verify rate limit response format
-    rate_limited_response = rate_limited[0].json()
+    rate_limited_response = last_429.json()
     assert "detail" in rate_limited_response
     detail = rate_limited_response["detail"]
     assert detail["error"] == "rate_limit_exceeded"
@@ -363,21 +327,20 @@ def test_rate_limiting_conversation_endpoint(test_client):
     assert detail["endpoint_type"] == "conversation"
     assert detail["retry_after"] == 45
 
-def test_rate_limiting_cleanup_endpoint(test_client):
+async def test_rate_limiting_cleanup_endpoint(async_client):
     """Test rate limiting for cleanup endpoint"""
     # Make multiple requests to cleanup endpoint
-    responses = []
-    for _ in range(15):  # Exceeds the 10/minute limit
-        response = test_client.post("/api/v1/chat/cleanup", json={"days_old": 30})
-        responses.append(response)
-        time.sleep(0.01)  # Small delay to avoid overwhelming the test server
+    last_429 = None
+    for _ in range(_limit_amount(CLEANUP_RATE_LIMIT) + 5):
+        response = await async_client.post("/api/v1/chat/cleanup", content=CLEANUP_PAYLOAD, headers=JSON_HEADERS)
+        if response.status_code == 429:
+            last_429 = response
+            break
     
-    # Count rate limited responses
-    rate_limited = [r for r in responses if r.status_code == 429]
-    assert len(rate_limited) > 0
+    assert last_429 is not None
     
     # Verify rate limit response format
-    rate_limited_response = rate_limited[0].json()
+    rate_limited_response = last_429.json()
     assert "detail" in rate_limited_response
     detail = rate_limited_response["detail"]
     assert detail["error"] == "rate_limit_exceeded"
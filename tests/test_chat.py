@@ -1,102 +1,105 @@
 import pytest
-from unittest.mock import MagicMock, patch
-from src.chat import ConversationHistory, generate_response
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from src import chat
+from src.chat import generate_response
+from src.conversation import Conversation, InMemoryBackend
 
-@pytest.fixture
-def conversation_history():
-    """Create a conversation history for testing"""
-    return ConversationHistory(max_history=3)
+pytestmark = pytest.mark.unit
+
+@pytest.fixture(scope="session")
+def _shared_conversation():
+    """Create one in-memory conversation for the whole session"""
+    return Conversation(id="test_chat", max_messages=3, backend=InMemoryBackend())
 
-def test_conversation_history_add_message(conversation_history):
-    """Test adding messages to conversation history"""
+@pytest.fixture
+def conversation(_shared_conversation, monkeypatch):
+    """Provide an emptied conversation, registered with the chat module's manager"""
+    _shared_conversation.messages.clear()
+    monkeypatch.setitem(chat.conversation_manager.conversations, _shared_conversation.id, _shared_conversation)
+    return _shared_conversation
+
+def test_conversation_add_message(conversation):
+    """Test adding messages to a conversation"""
     # Add user message
-    conversation_history.add_message("user", "Hello")
-    messages = conversation_history.get_messages()
+    conversation.add_message("user", "Hello")
+    messages = conversation.get_messages()
     assert len(messages) == 1
     assert messages[0]["role"] == "user"
     assert messages[0]["content"] == "Hello"
-    
+
     # Add assistant message
-    conversation_history.add_message("assistant", "Hi there!")
-    messages = conversation_history.get_messages()
+    conversation.add_message("assistant", "Hi there!")
+    messages = conversation.get_messages()
     assert len(messages) == 2
     assert messages[1]["role"] == "assistant"
     assert messages[1]["content"] == "Hi there!"
 
-def test_conversation_history_max_length(conversation_history):
+def test_conversation_max_length(conversation):
     """Test conversation history respects max length"""
-    # Add more messages than max_history
-    conversation_history.add_message("user", "Message 1")
-    conversation_history.add_message("assistant", "Response 1")
-    conversation_history.add_message("user", "Message 2")
-    conversation_history.add_message("assistant", "Response 2")
-    
-    messages = conversation_history.get_messages()
-    assert len(messages) == 3  # max_history is 3
+    # Add more messages than max_messages
+    conversation.add_message("user", "Message 1")
+    conversation.add_message("assistant", "Response 1")
+    conversation.add_message("user", "Message 2")
+    conversation.add_message("assistant", "Response 2")
+
+    messages = conversation.get_messages()
+    assert len(messages) == 3  # max_messages is 3
     assert messages[0]["content"] == "Response 1"  # Oldest message within limit
     assert messages[-1]["content"] == "Response 2"  # Most recent message
 
-def test_conversation_history_clear(conversation_history):
-    """Test clearing conversation history"""
-    conversation_history.add_message("user", "Test message")
-    assert len(conversation_history.get_messages()) == 1
-    
-    conversation_history.clear()
-    assert len(conversation_history.get_messages()) == 0
+_RESPONSE = SimpleNamespace(
+    choices=[SimpleNamespace(message=SimpleNamespace(content="This is a test response"))],
+    usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15)
+)
 
 @pytest.fixture
-def mock_openai():
+def mock_openai(call_spy):
     """Create a mock OpenAI client"""
     mock_client = MagicMock()
-    
-    # Mock the chat completions create method
-    mock_response = MagicMock()
-    mock_response.choices = [MagicMock()]
-    mock_response.choices[0].message.content = "This is a test response"
-    
-    mock_client.chat.completions.create.return_value = mock_response
+    mock_client.chat.completions.create = call_spy(_RESPONSE)
     return mock_client
 
 @pytest.fixture
 def mock_query():
-    """Create a mock query function"""
-    return MagicMock()
+    """Create a mock vector search returning no chunks"""
+    return AsyncMock(return_value=[])
 
-def test_generate_response(mock_openai, mock_query, conversation_history):
+async def test_generate_response(mock_openai, mock_query, conversation):
     """Test response generation"""
     query = "Tell me about Test Restaurant"
-    response = generate_response(
+    response = await generate_response(
         query=query,
-        conversation_history=conversation_history,
-        client=mock_openai
+        conversation_id=conversation.id,
+        client=mock_openai,
+        get_similar_chunks=mock_query
     )
 
     # Verify response
     assert response is not None
     assert response == "This is a test response"
-    
+
     # Verify the OpenAI API was called correctly
-    mock_openai.chat.completions.create.assert_called_once()
-    call_args = mock_openai.chat.completions.create.call_args[1]
+    assert mock_openai.chat.completions.create.call_count == 1
+    call_args = mock_openai.chat.completions.create.last_kwargs
     assert call_args["model"] == "gpt-3.5-turbo"
     assert call_args["temperature"] == 0.7
-    assert call_args["max_tokens"] == 150
+    assert call_args["max_tokens"] == 500
 
-def test_generate_response_with_context(mock_openai, mock_query, conversation_history):
+async def test_generate_response_with_context(mock_openai, mock_query, conversation):
     """Test response generation with context from vector search"""
     # Mock the query response
     mock_query.return_value = [{
-        "restaurant": "Test Restaurant",
-        "rating": "4.5",
-        "price_range": "$$",
-        "description": "A cozy restaurant known for its delicious food",
+        "metadata": {
+            "text": "Test Restaurant (rating 4.5, $$): A cozy restaurant known for its delicious food"
+        },
         "score": 0.95
     }]
 
     query = "What's good at Test Restaurant?"
-    response = generate_response(
+    response = await generate_response(
         query=query,
-        conversation_history=conversation_history,
+        conversation_id=conversation.id,
         client=mock_openai,
         get_similar_chunks=mock_query
     )
@@ -104,38 +107,41 @@ def test_generate_response_with_context(mock_openai, mock_query, conversation_hi
     # Verify response
     assert response is not None
     assert response == "This is a test response"
+    mock_query.assert_awaited_once_with(query, top_k=3)
+
+    # Verify that context was included in the single prompt
+    assert mock_openai.chat.completions.create.call_count == 1
+    prompt_messages = mock_openai.chat.completions.create.last_kwargs["messages"]
+    system_message = {m["role"]: m for m in prompt_messages}["system"]
 
-    # Verify that context was included in the prompt
-    prompt_messages = mock_openai.chat.completions.create.call_args[1]["messages"]
-    system_message = next(m for m in prompt_messages if m["role"] == "system")
-    
     # Check for key elements in the system message
     assert "Test Restaurant" in system_message["content"]
     assert "4.5" in system_message["content"]
     assert "$$" in system_message["content"]
     assert "cozy restaurant" in system_message["content"]
-    assert "0.95" in system_message["content"]
 
-def test_generate_response_with_history(mock_openai, mock_query, conversation_history):
+async def test_generate_response_with_history(mock_openai, mock_query, conversation):
     """Test response generation with conversation history"""
     # Add some history
-    conversation_history.add_message("user", "Tell me about Test Restaurant")
-    conversation_history.add_message("assistant", "Test Restaurant is great!")
+    conversation.add_message("user", "Tell me about Test Restaurant")
+    conversation.add_message("assistant", "Test Restaurant is great!")
 
     # New query
     query = "What's on their menu?"
-    response = generate_response(
+    response = await generate_response(
         query=query,
-        conversation_history=conversation_history,
-        client=mock_openai
+        conversation_id=conversation.id,
+        client=mock_openai,
+        get_similar_chunks=mock_query
     )
 
     # Verify response
     assert response is not None
     assert response == "This is a test response"
 
-    # Verify that history was included in the prompt
-    prompt_messages = mock_openai.chat.completions.create.call_args[1]["messages"]
+    # Verify that history was included in the single prompt
+    assert mock_openai.chat.completions.create.call_count == 1
+    prompt_messages = mock_openai.chat.completions.create.last_kwargs["messages"]
     history_messages = [m for m in prompt_messages if m["role"] in ("user", "assistant")]
     assert len(history_messages) == 3  # 2 history messages + current query
     assert history_messages[0]["role"] == "user"
@@ -145,17 +151,19 @@ def test_generate_response_with_history(mock_openai, mock_query, conversation_hi
     assert history_messages[2]["role"] == "user"
     assert history_messages[2]["content"] == "What's on their menu?"
 
-def test_generate_response_error_handling(mock_openai, mock_query, conversation_history):
+async def test_generate_response_error_handling(mock_openai, mock_query, conversation):
     """Test error handling in response generation"""
     # Make the OpenAI client raise an exception
     mock_openai.chat.completions.create.side_effect = Exception("Test error")
-    
+
     query = "Tell me about Test Restaurant"
-    response = generate_response(
+    response = await generate_response(
         query=query,
-        conversation_history=conversation_history,
-        client=mock_openai
+        conversation_id=conversation.id,
+        client=mock_openai,
+        get_similar_chunks=mock_query
     )
-    
-    # Verify that None is returned on error
-    assert response is None 
\ No newline at end of file
+
+    # Verify that None is returned on error, without retrying
+    assert response is None
+    assert mock_openai.chat.completions.create.call_count == 1
@@ -3,8 +3,9 @@
 import pytest
 import time
 import json
-from pathlib import Path
-from src.conversation import Message, Conversation, ConversationManager
+from src.conversation import Message, Conversation, ConversationManager, InMemoryBackend, StorageBackend
+
+pytestmark = pytest.mark.unit
 
 @pytest.fixture
 def temp_storage_dir(tmp_path):
@@ -14,9 +15,14 @@ def temp_storage_dir(tmp_path):
     return storage_dir
 
 @pytest.fixture
-def conversation_manager(temp_storage_dir):
-    """Create a conversation manager with temporary storage"""
-    return ConversationManager(storage_dir=str(temp_storage_dir))
+def backend():
+    """Create an in-memory storage backend"""
+    return InMemoryBackend()
+
+@pytest.fixture
+def conversation_manager(backend):
+    """Create a conversation manager backed by memory"""
+    return ConversationManager(backend=backend)
 
 def test_message_creation():
     """Test creating a message with metadata"""
@@ -71,8 +77,7 @@ def test_conversation_get_context_window():
     conv = Conversation(id="test_conv")
     
     # Add multiple messages
-    for i in range(10):
-        conv.add_message("user", f"Message {i}")
+    conv.add_messages([("user", f"Message {i}") for i in range(10)])
     
     # Get context window
     window = conv.get_context_window(window_size=5)
@@ -84,10 +89,10 @@ def test_conversation_pruning():
     conv = Conversation(id="test_conv", max_messages=5)
     
     # Add more messages than max_messages
-    for i in range(10):
-        conv.add_message("user", f"Message {i}")
+    conv.add_messages([("user", f"Message {i}") for i in range(10)])
     
     assert len(conv.messages) == 5
+    assert conv.messages[0].content == "Message 5"
     assert conv.messages[-1].content == "Message 9"
 
 def test_conversation_persistence(temp_storage_dir):
@@ -111,11 +116,11 @@ def test_conversation_persistence(temp_storage_dir):
     assert len(data["messages"]) == 1
     assert data["messages"][0]["content"] == "Test message"
 
-def test_conversation_manager_operations(conversation_manager):
+def test_conversation_manager_operations(conversation_manager, backend):
     """Test conversation manager operations"""
     # Create conversations
-    conv1 = conversation_manager.get_conversation("conv1")
-    conv2 = conversation_manager.get_conversation("conv2")
+    for conv_id in ("conv1", "conv2"):
+        conversation_manager.conversations[conv_id] = Conversation(id=conv_id)
     
     # Add messages
     conversation_manager.add_message("conv1", "user", "Hello from conv1")
@@ -126,14 +131,19 @@ def test_conversation_manager_operations(conversation_manager):
     assert len(recent) == 2
     
     # Verify conversations were saved
-    saved_files = list(Path(conversation_manager.storage_dir).glob("*.json"))
-    assert len(saved_files) == 2
+    assert sorted(data["id"] for data in backend.list()) == ["conv1", "conv2"]
+    assert backend.load("conv1")["messages"][0]["content"] == "Hello from conv1"
+    
+    # A new manager on the same backend restores the conversations
+    reloaded = ConversationManager(backend=backend)
+    assert reloaded.get_conversation("conv2").messages[0].content == "Hello from conv2"
 
-def test_conversation_cleanup(conversation_manager):
+def test_conversation_cleanup(conversation_manager, backend):
     """Test cleaning up old conversations"""
     # Create old and new conversations
-    old_conv = conversation_manager.get_conversation("old_conv")
-    new_conv = conversation_manager.get_conversation("new_conv")
+    old_conv = Conversation(id="old_conv", backend=backend)
+    conversation_manager.conversations["old_conv"] = old_conv
+    conversation_manager.conversations["new_conv"] = Conversation(id="new_conv")
     
     # Modify last_updated for old conversation
     old_conv.last_updated = time.time() - (31 * 24 * 60 * 60)  # 31 days old
@@ -146,9 +156,18 @@ def test_conversation_cleanup(conversation_manager):
     conversation_manager.cleanup_old_conversations(days_old=30)
     
     # Verify old conversation was removed
-    remaining_files = list(Path(conversation_manager.storage_dir).glob("*.json"))
-    assert len(remaining_files) == 1
-    assert remaining_files[0].stem == "new_conv"
+    assert backend.load("old_conv") is None
+    assert [data["id"] for data in backend.list()] == ["new_conv"]
+    assert list(conversation_manager.conversations) == ["new_conv"]
+
+def test_incomplete_storage_backend_rejected():
+    """Test that a backend missing part of the interface cannot be instantiated"""
+    class SaveOnlyBackend(StorageBackend):
+        def save(self, conversation):
+            pass
+    
+    with pytest.raises(TypeError):
+        SaveOnlyBackend()
 
 def test_conversation_metadata():
     """Test conversation metadata handling"""
@@ -1,88 +1,95 @@
+import hashlib
+from collections import OrderedDict
 import pytest
-import asyncio
 import numpy as np
-from src.embedding import generate_embedding
+from types import SimpleNamespace
+from src import embedding as embedding_module
+from src.embedding import get_embedding, batch_generate_embeddings
+
+pytestmark = pytest.mark.unit
+
+class FakeEmbeddings:
+    """Stand-in for client.embeddings returning deterministic 1536-d vectors"""
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def _vector(text):
+        # Seed from the text so the same input always maps to the same vector
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+        return np.random.default_rng(seed).random(1536).tolist()
+
+    def create(self, model, input):
+        self.calls.append(input)
+        texts = [input] if isinstance(input, str) else input
+        if any(not text.strip() for text in texts):
+            # The API rejects blank input
+            raise ValueError("'$.input' is invalid")
+        return SimpleNamespace(data=[SimpleNamespace(embedding=self._vector(text)) for text in texts])
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """Route src.embedding's OpenAI client to FakeEmbeddings, without retry delays or cached vectors"""
+    fake = FakeEmbeddings()
+    monkeypatch.setattr(embedding_module, "_embedding_cache", OrderedDict())
+    monkeypatch.setattr(embedding_module, "get_openai_client", lambda: SimpleNamespace(embeddings=fake))
+    monkeypatch.setattr(embedding_module, "RETRY_DELAY", 0)
+    return fake
+
+@pytest.mark.parametrize("text", [
+    "Test restaurant query",
+    "restaurant " * 1000,  # Long input
+    "Restaurant & Café! #1 (Best) [Food]",  # Special characters
+], ids=["valid", "long", "special_chars"])
+async def test_generate_embedding_valid_input(fake_embeddings, text):
+    """Test embedding generation with valid, long and special-character input"""
+    embedding = await get_embedding(text)
 
-def test_generate_embedding_valid_input():
-    """Test embedding generation with valid input"""
-    text = "Test restaurant query"
-    embedding = generate_embedding(text)
-    
     # Check that we get a valid embedding
     assert embedding is not None
     assert isinstance(embedding, list)
     assert len(embedding) == 1536  # OpenAI embedding dimension
     assert all(isinstance(x, float) for x in embedding)
 
-def test_generate_embedding_empty_input():
-    """Test embedding generation with empty input"""
-    text = ""
-    embedding = generate_embedding(text)
-    
-    # Should return None for empty input
-    assert embedding is None
+@pytest.mark.parametrize("text", ["", "   \n\t   "], ids=["empty", "whitespace"])
+async def test_generate_embedding_blank_input(fake_embeddings, text):
+    """Test embedding generation with empty or whitespace-only input"""
+    embedding = await get_embedding(text)
 
-def test_generate_embedding_whitespace_input():
-    """Test embedding generation with whitespace input"""
-    text = "   \n\t   "
-    embedding = generate_embedding(text)
-    
-    # Should return None for whitespace-only input
+    # Should return None for blank input
     assert embedding is None
 
-def test_generate_embedding_long_input():
-    """Test embedding generation with long input"""
-    # Create a long text input
-    text = "restaurant " * 1000
-    embedding = generate_embedding(text)
-    
-    # Should still get a valid embedding
-    assert embedding is not None
-    assert isinstance(embedding, list)
-    assert len(embedding) == 1536
-
-def test_generate_embedding_special_chars():
-    """Test embedding generation with special characters"""
-    text = "Restaurant & Café! #1 (Best) [Food]"
-    embedding = generate_embedding(text)
-    
-    # Should handle special characters
-    assert embedding is not None
-    assert isinstance(embedding, list)
-    assert len(embedding) == 1536
-
 @pytest.mark.asyncio
-async def test_generate_embedding_concurrent():
-    """Test concurrent embedding generation"""
+async def test_generate_embedding_concurrent(fake_embeddings):
+    """Test batched embedding generation for several texts"""
     texts = [
         "First restaurant query",
         "Second restaurant query",
         "Third restaurant query"
     ]
-    
-    # Generate embeddings concurrently
-    embeddings = await asyncio.gather(*[
-        asyncio.to_thread(generate_embedding, text)
-        for text in texts
-    ])
-    
+
+    # Generate all embeddings with a single batched request
+    embeddings = await batch_generate_embeddings(texts)
+    assert fake_embeddings.calls == [texts]
+
     # Check all embeddings
+    assert len(embeddings) == len(texts)
     for embedding in embeddings:
         assert embedding is not None
         assert isinstance(embedding, list)
         assert len(embedding) == 1536
 
-def test_generate_embedding_consistency():
+async def test_generate_embedding_consistency(fake_embeddings):
     """Test that same input produces consistent embeddings"""
     text = "Test restaurant consistency"
-    
+
     # Generate embeddings multiple times
-    embedding1 = generate_embedding(text)
-    embedding2 = generate_embedding(text)
-    
+    embedding1 = await get_embedding(text)
+    embedding2 = await get_embedding(text)
+
     # Convert to numpy arrays for comparison
     arr1 = np.array(embedding1)
     arr2 = np.array(embedding2)
-    
+
     # Check that embeddings are identical
-    assert np.allclose(arr1, arr2) 
\ No newline at end of file
+    assert np.allclose(arr1, arr2)
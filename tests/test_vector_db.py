@@ -1,61 +1,34 @@
 import pytest
 import numpy as np
-from typing import List, Dict, Any
-from unittest.mock import MagicMock, patch
+from typing import List
+from unittest.mock import Mock, MagicMock, patch
 from src.embedding import EmbeddedChunk
 from src.vector_db import init_pinecone, upsert_embeddings, query_similar, convert_to_native_types
 
-class MockPineconeIndex:
-    def __init__(self):
-        self.vectors = {}
-        self.dimension = 1536
-        self.name = "restaurant-chatbot"
-        
-    def describe_index_stats(self):
-        return {
-            "dimension": self.dimension,
-            "total_vector_count": len(self.vectors),
-            "namespaces": {}
-        }
-        
-    def upsert(self, vectors: List[Dict[str, Any]]):
-        for vector in vectors:
-            self.vectors[vector["id"]] = {
-                "values": vector["values"],
-                "metadata": vector.get("metadata", {})
-            }
-            
-    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = True):
-        # Simple mock implementation - return all vectors with mock scores
-        matches = []
-        for vid, v in self.vectors.items():
-            matches.append({
-                "id": vid,
-                "score": 0.99,  # Mock similarity score
-                "metadata": v["metadata"] if include_metadata else None
-            })
-        return {"matches": matches[:top_k]}
+pytestmark = pytest.mark.unit
+
+# Random query vector, generated once at import with a fixed seed
+RANDOM_QUERY_EMBEDDING = list(np.random.default_rng(0).random(1536))
 
 @pytest.fixture(autouse=True)
-def mock_pinecone():
+def mock_pinecone(mock_index_factory):
     """Create a mock Pinecone client"""
-    mock_index = MockPineconeIndex()
+    mock_index = mock_index_factory()
     mock_pc = MagicMock()
     mock_pc.Index.return_value = mock_index
     
-    # Create a mock index object with the correct name
-    mock_index_obj = MagicMock()
-    mock_index_obj.name = "restaurant-chatbot"
-    mock_pc.list_indexes.return_value = [mock_index_obj]
+    # Index listing that already contains our index
+    mock_pc.list_indexes.return_value = MagicMock(names=Mock(return_value={"restaurant-chatbot"}))
     
     with patch("src.vector_db.Pinecone", return_value=mock_pc):
         yield mock_pc
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_chunks(mock_embedding) -> List[EmbeddedChunk]:
-    """Create test chunks with embeddings"""
+    """Create test chunks with embeddings once per session (treat as read-only)"""
     return [
         EmbeddedChunk(
+            id="test-chunk-1",
             text="Test Restaurant 1 is a great place to eat",
             embedding=mock_embedding,
             metadata={
@@ -66,6 +39,7 @@ def test_chunks(mock_embedding) -> List[EmbeddedChunk]:
             }
         ),
         EmbeddedChunk(
+            id="test-chunk-2",
             text="Test Restaurant 2 serves amazing food",
             embedding=mock_embedding,
             metadata={
@@ -91,6 +65,7 @@ def test_convert_to_native_types():
     # Test with numpy scalar
     np_float = np.float64(3.14)
     assert isinstance(convert_to_native_types(np_float), float)
+    assert type(convert_to_native_types(np.bool_(True))) is bool
     
     # Test with numpy array
     np_array = np.array([1.0, 2.0, 3.0])
@@ -111,6 +86,18 @@ def test_convert_to_native_types():
     assert isinstance(result["array"], list)
     assert isinstance(result["nested"]["value"], int)
 
+def test_convert_to_native_types_copies_containers():
+    """Test that the result never shares dicts or lists with the input"""
+    clean = {"tags": ["a", "b"], "nested": {"rating": 4.5}}
+    result = convert_to_native_types(clean)
+    assert result == clean
+    
+    # Mutating the result leaves the input unchanged
+    result["tags"].append("c")
+    result["nested"]["rating"] = 1.0
+    result["extra"] = True
+    assert clean == {"tags": ["a", "b"], "nested": {"rating": 4.5}}
+
 def test_upsert_embeddings(mock_pinecone, test_chunks):
     """Test upserting embeddings to Pinecone"""
     index = init_pinecone()
@@ -170,9 +157,8 @@ def test_query_similar_empty_index(mock_pinecone):
     index = init_pinecone()
     assert index is not None
     
-    # Create a random query vector
-    query_embedding = list(np.random.rand(1536))
-    results = query_similar(index, query_embedding)
+    # Use the precomputed random query vector
+    results = query_similar(index, RANDOM_QUERY_EMBEDDING)
     
     # Should return empty list
     assert len(results) == 0 
\ No newline at end of file
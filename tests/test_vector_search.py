@@ -1,10 +1,18 @@
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 import pytest
 import numpy as np
-from typing import List, Dict, Any
+from typing import Any, Dict, List
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 from src.vector_db import init_pinecone, upsert_embeddings, query_similar, delete_old_vectors, SearchResult
 from src.embedding import EmbeddedChunk, get_embedding, create_restaurant_embedding
 
+pytestmark = pytest.mark.unit
+
 # Test data
 TEST_RESTAURANT = {
     "id": "test123",
@@ -17,111 +25,118 @@ TEST_RESTAURANT = {
     "location": "123 Test St"
 }
 
-class MockPineconeIndex:
-    """Mock Pinecone index for testing"""
-    def __init__(self):
-        self.vectors = {}
-        self.dimension = 1536
-        self.name = "restaurant-chatbot"
-        self.describe_index_stats = Mock(return_value={
-            "dimension": self.dimension,
-            "total_vector_count": 0,
-            "namespaces": {}
-        })
-        
-    def upsert(self, vectors: List[Dict[str, Any]]):
-        for vector in vectors:
-            self.vectors[vector["id"]] = {
-                "values": vector["values"],
-                "metadata": vector.get("metadata", {})
-            }
-            
-    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = True, filter: Dict = None):
-        # Simple mock implementation - return all vectors with mock scores
-        matches = []
-        for vid, v in self.vectors.items():
-            # Apply filter if provided
-            if filter and not self._matches_filter(v["metadata"], filter):
-                continue
-                
-            matches.append({
-                "id": vid,
-                "score": 0.99,  # Mock similarity score
-                "metadata": v["metadata"] if include_metadata else None
-            })
-        return {"matches": matches[:top_k]}
-        
-    def _matches_filter(self, metadata: Dict[str, Any], filter_dict: Dict[str, Any]) -> bool:
-        """Check if metadata matches filter criteria"""
-        for key, value in filter_dict.items():
-            if key not in metadata or metadata[key] != value:
-                return False
-        return True
-        
-    def delete(self, ids: List[str] = None, filter: Dict = None):
-        """Mock delete operation"""
-        if ids:
-            for id in ids:
-                self.vectors.pop(id, None)
-        elif filter:
-            to_delete = []
-            for vid, v in self.vectors.items():
-                if self._matches_filter(v["metadata"], filter):
-                    to_delete.append(vid)
-            for vid in to_delete:
-                self.vectors.pop(vid)
+# Shared read-only embedding vector
+TEST_EMBEDDING = np.full(1536, 0.1, dtype=np.float32)
+TEST_EMBEDDING.flags.writeable = False
+# int8-quantized counterpart for the quantized query path
+TEST_EMBEDDING_I8 = np.full(1536, 12, dtype=np.int8)
+TEST_EMBEDDING_I8.flags.writeable = False
 
-@pytest.fixture
-def mock_pinecone():
-    """Create a mock Pinecone client"""
-    mock_index = MockPineconeIndex()
+@dataclass(frozen=True)
+class _Match:
+    """A single query match as returned by the index"""
+    id: str
+    score: float
+    metadata: Dict[str, Any]
+
+def _make_match_array(ids, scores, metas) -> np.recarray:
+    """Build query matches as a record array; each row exposes .id, .score and .metadata"""
+    return np.rec.fromarrays(
+        [np.asarray(ids), np.asarray(scores, dtype=np.float32), np.asarray(metas, dtype=object)],
+        names="id,score,metadata"
+    )
+
+RESULT_KEYS = {"id", "score", "metadata"}
+
+def _assert_result_schema(results: List[Dict[str, Any]]) -> np.ndarray:
+    """Check every result is a dict with the expected keys; return their scores as an array"""
+    assert all(isinstance(r, dict) and RESULT_KEYS <= r.keys() for r in results)
+    return np.fromiter((r["score"] for r in results), dtype=np.float32, count=len(results))
+
+@pytest.fixture(scope="module")
+def mock_pinecone(mock_index_factory):
+    """Create a mock Pinecone client shared by the tests in this module"""
     mock_pc = MagicMock()
-    mock_pc.Index.return_value = mock_index
+    mock_pc.Index.return_value = mock_index_factory()
     
-    # Create a mock index object with the correct name
-    mock_index_obj = MagicMock()
-    mock_index_obj.name = "restaurant-chatbot"
-    mock_pc.list_indexes.return_value = [mock_index_obj]
+    # Index listing that already contains our index
+    mock_pc.list_indexes.return_value = MagicMock(names=Mock(return_value={"restaurant-chatbot"}))
     
-    with patch("src.vector_db.Pinecone", return_value=mock_pc):
-        with patch.dict('os.environ', {'PINECONE_API_KEY': 'test-key'}):
-            yield mock_pc
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("PINECONE_API_KEY", "test-key")
+        mp.setattr("src.vector_db.Pinecone", lambda *args, **kwargs: mock_pc)
+        yield mock_pc
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_openai():
-    """Mock OpenAI client"""
-    with patch("src.embedding.OpenAI") as mock_client:
-        # Create mock response
-        mock_response = Mock()
-        mock_response.data = [Mock(embedding=[0.1] * 1536)]
-        
-        # Set up client mock
-        mock_instance = Mock()
-        mock_instance.embeddings.create.return_value = mock_response
-        mock_client.return_value = mock_instance
-        
-        # Set environment variables
-        with patch.dict('os.environ', {'OPENAI_API_KEY': 'test-key'}):
-            yield mock_client
+    """Mock OpenAI client shared by the tests in this module"""
+    # Build one response per distinct input, keyed by a hash of the input
+    responses: Dict[bytes, Mock] = {}
+    
+    def create_embedding(**kwargs):
+        key = hashlib.sha256(repr(kwargs["input"]).encode()).digest()
+        if key not in responses:
+            responses[key] = Mock(data=[Mock(embedding=TEST_EMBEDDING)])
+        return responses[key]
+    
+    # Set up client mock
+    mock_instance = Mock()
+    mock_instance.embeddings.create.side_effect = create_embedding
+    mock_client = MagicMock(return_value=mock_instance)
+    
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("src.embedding.OpenAI", mock_client)
+        mp.setenv("OPENAI_API_KEY", "test-key")
+        yield mock_client
+
+@pytest.fixture(autouse=True)
+def _reset_mock_state(mock_pinecone, mock_openai, mock_index_factory, monkeypatch):
+    """Give each test a fresh index, an empty embedding cache and clean call records on the shared mocks"""
+    monkeypatch.setattr("src.embedding._embedding_cache", OrderedDict())
+    mock_pinecone.Index.return_value = mock_index_factory()
+    mock_pinecone.reset_mock()
+    mock_pinecone.query.reset_mock(return_value=True, side_effect=True)
+    mock_openai.reset_mock()
 
 @pytest.fixture
 async def test_embedding(mock_openai):
     """Create a test restaurant embedding"""
     # Mock get_embedding function
-    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=[0.1] * 1536)):
+    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=TEST_EMBEDDING)):
         return await create_restaurant_embedding(TEST_RESTAURANT)
 
+# Cap concurrent embedding requests so unmocked runs stay within provider rate limits
+EMBEDDING_CONCURRENCY = 5
+
+async def _gather_bounded(coros, limit: int = EMBEDDING_CONCURRENCY):
+    """Await coroutines concurrently, at most `limit` at a time"""
+    sem = asyncio.Semaphore(limit)
+    
+    async def _bounded(coro):
+        async with sem:
+            return await coro
+    
+    return await asyncio.gather(*(_bounded(c) for c in coros))
+
+@pytest.fixture
+async def test_embeddings(mock_openai, n):
+    """Create n restaurant embeddings concurrently"""
+    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=TEST_EMBEDDING)):
+        return await _gather_bounded(
+            create_restaurant_embedding(dict(TEST_RESTAURANT, id=f"r{i}")) for i in range(n)
+        )
+
 @pytest.mark.asyncio
 async def test_create_restaurant_embedding(mock_openai):
     """Test creating an embedding for a restaurant"""
     # Mock get_embedding function
-    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=[0.1] * 1536)):
+    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=TEST_EMBEDDING)):
         embedding = await create_restaurant_embedding(TEST_RESTAURANT)
         
         assert embedding is not None
         assert isinstance(embedding, EmbeddedChunk)
         assert embedding.text.startswith("Test Italian Restaurant is a Italian")
-        assert len(embedding.embedding) == 1536
+        assert embedding.embedding.shape == (1536,)
         assert embedding.metadata["restaurant_id"] == "test123"
         assert embedding.metadata["restaurant_name"] == "Test Italian Restaurant"
         assert embedding.metadata["type"] == "restaurant_overview"
@@ -130,9 +145,12 @@ def test_init_pinecone(mock_pinecone):
     """Test Pinecone initialization"""
     index = init_pinecone()
     assert index is not None
-    assert index.describe_index_stats.call_count == 1
-    stats = index.describe_index_stats()
-    assert stats is not None
+    # The existing index is found by name, so nothing is created
+    mock_pinecone.list_indexes.return_value.names.assert_called_once()
+    mock_pinecone.create_index.assert_not_called()
+    # Check the stats init_pinecone already fetched rather than asking again
+    assert len(index.stats_calls) == 1
+    stats = index.stats_calls[0]
     assert "dimension" in stats
     assert stats["dimension"] == 1536  # OpenAI embedding dimension
 
@@ -152,12 +170,104 @@ def test_upsert_embeddings(mock_pinecone, test_embedding):
     assert len(vector_data) == 1536
     assert metadata["restaurant_name"] == "Test Italian Restaurant"
 
+@pytest.mark.parametrize("n", [1, 25])
+def test_upsert_many_embeddings(mock_pinecone, test_embeddings, n):
+    """Test upserting a batch of concurrently created embeddings"""
+    assert len(test_embeddings) == n
+    assert all(isinstance(e, EmbeddedChunk) for e in test_embeddings)
+    
+    index = mock_pinecone
+    assert upsert_embeddings(index, test_embeddings) is True
+    
+    vectors = index.upsert.call_args[1]["vectors"]
+    assert [v[0] for v in vectors] == [f"r{i}" for i in range(n)]
+
+# The MagicMock index records every upserted vector, so batching tests use short vectors
+SMALL_EMBEDDING = np.zeros(8, dtype=np.float32)
+SMALL_EMBEDDING.flags.writeable = False
+
+# Three full batches plus a partial one cover every batching boundary
+@pytest.mark.parametrize("n,batch_size", [(1, 64), (3 * 64 + 1, 64), (3 * 1000 + 1, 1000)])
+def test_upsert_embeddings_batching(mock_pinecone, n, batch_size):
+    """Test that upserts are grouped into batches of batch_size"""
+    index = mock_pinecone
+    chunks = [
+        EmbeddedChunk(id=f"chunk{i}", text=f"Chunk {i}", embedding=SMALL_EMBEDDING, metadata={})
+        for i in range(n)
+    ]
+    
+    assert upsert_embeddings(index, chunks, batch_size=batch_size) is True
+    
+    assert index.upsert.call_count == math.ceil(n / batch_size)
+    sizes = [len(c.kwargs["vectors"]) for c in index.upsert.call_args_list]
+    assert max(sizes) <= batch_size
+    assert sum(sizes) == n
+
+def _distinct_chunks(n: int) -> List[EmbeddedChunk]:
+    """Chunks with distinct random embeddings, so each is its own nearest neighbour"""
+    embeddings = np.random.default_rng(7).random((n, 1536), dtype=np.float32)
+    return [
+        EmbeddedChunk(
+            id=f"chunk{i}",
+            text=f"Restaurant {i} serves food",
+            embedding=embeddings[i],
+            metadata={"type": "restaurant_overview", "restaurant_name": f"Restaurant {i}"}
+        )
+        for i in range(n)
+    ]
+
+def test_upsert_and_query_through_index(mock_pinecone):
+    """Test upserting and querying against the mock index returned by init_pinecone"""
+    index = init_pinecone()
+    chunks = _distinct_chunks(3)
+    assert upsert_embeddings(index, chunks) is True
+    assert set(index.vectors) == {"chunk0", "chunk1", "chunk2"}
+    
+    results = query_similar(index, chunks[1].embedding, top_k=2, score_threshold=0.0)
+    
+    assert len(results) == 2
+    assert results[0]["id"] == "chunk1"
+    assert results[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert results[0]["score"] > results[1]["score"]
+    assert results[0]["metadata"]["restaurant_name"] == "Restaurant 1"
+
+def test_query_top_k_through_index(mock_pinecone):
+    """Test that the mock index returns exactly the top_k best rows, best first"""
+    index = init_pinecone()
+    chunks = _distinct_chunks(200)
+    assert upsert_embeddings(index, chunks) is True
+    query = chunks[0].embedding
+    
+    results = query_similar(index, query, top_k=5, score_threshold=0.0)
+    
+    # Brute-force ranking of every stored vector
+    mat = np.stack([c.embedding for c in chunks])
+    scores = mat @ query / (np.linalg.norm(mat, axis=1) * np.linalg.norm(query))
+    expected = [chunks[i].id for i in np.argsort(-scores)[:5]]
+    assert [r["id"] for r in results] == expected
+
+@pytest.mark.parametrize("filter_dict,expected", [
+    ({"restaurant_name": "Restaurant 2"}, ["chunk2"]),
+    ({"restaurant_name": {"$in": ["Restaurant 0", "Restaurant 3"]}}, ["chunk0", "chunk3"]),
+    ({"restaurant_name": {"$ne": "Restaurant 1"}, "type": "restaurant_overview"}, ["chunk0", "chunk2", "chunk3"]),
+    ({"cuisine_type": "Italian"}, []),
+], ids=["eq", "in", "ne_and_eq", "missing_key"])
+def test_query_similar_filter_through_index(mock_pinecone, filter_dict, expected):
+    """Test that metadata filters restrict the matches the mock index returns"""
+    index = init_pinecone()
+    chunks = _distinct_chunks(4)
+    assert upsert_embeddings(index, chunks) is True
+    
+    results = query_similar(index, chunks[1].embedding, top_k=10, score_threshold=0.0, filter=filter_dict)
+    
+    assert sorted(r["id"] for r in results) == expected
+
 def test_query_similar(mock_pinecone):
     """Test querying similar vectors"""
     index = mock_pinecone
     
     # Mock query response
-    mock_match = Mock(
+    mock_match = _Match(
         id="test123",
         score=0.85,
         metadata={
@@ -171,7 +281,7 @@ def test_query_similar(mock_pinecone):
     # Test query
     results = query_similar(
         index=index,
-        query_embedding=[0.1] * 1536,
+        query_embedding=TEST_EMBEDDING,
         top_k=5,
         score_threshold=0.7
     )
@@ -181,6 +291,28 @@ def test_query_similar(mock_pinecone):
     assert results[0]["score"] == 0.85
     assert results[0]["metadata"]["restaurant_name"] == "Test Italian Restaurant"
 
+def test_query_similar_int8(mock_pinecone):
+    """Test querying with an int8-quantized embedding"""
+    index = mock_pinecone
+    index.query.return_value.matches = [
+        _Match(id="test123", score=0.85, metadata={"restaurant_name": "Test Italian Restaurant"})
+    ]
+    
+    results = query_similar(
+        index=index,
+        query_embedding=TEST_EMBEDDING_I8,
+        top_k=5
+    )
+    
+    # The quantized vector is widened to the plain float list Pinecone accepts
+    vector = index.query.call_args[1]["vector"]
+    assert type(vector) is list
+    assert len(vector) == 1536
+    assert all(type(x) is float for x in vector)
+    assert vector[0] == 12.0
+    assert len(results) == 1
+    assert results[0]["id"] == "test123"
+
 def test_query_similar_with_filters(mock_pinecone):
     """Test querying similar vectors with filters"""
     index = mock_pinecone
@@ -193,7 +325,7 @@ def test_query_similar_with_filters(mock_pinecone):
     
     query_similar(
         index=index,
-        query_embedding=[0.1] * 1536,
+        query_embedding=TEST_EMBEDDING,
         filter=filter_dict
     )
     
@@ -207,15 +339,15 @@ def test_query_similar_score_threshold(mock_pinecone):
     
     # Mock matches with different scores
     mock_matches = [
-        Mock(id="1", score=0.9, metadata={"name": "High Score"}),
-        Mock(id="2", score=0.6, metadata={"name": "Low Score"})
+        _Match(id="1", score=0.9, metadata={"name": "High Score"}),
+        _Match(id="2", score=0.6, metadata={"name": "Low Score"})
     ]
     index.query.return_value.matches = mock_matches
     
     # Query with threshold
     results = query_similar(
         index=index,
-        query_embedding=[0.1] * 1536,
+        query_embedding=TEST_EMBEDDING,
         score_threshold=0.8
     )
     
@@ -223,6 +355,26 @@ def test_query_similar_score_threshold(mock_pinecone):
     assert results[0]["id"] == "1"
     assert results[0]["score"] == 0.9
 
+@pytest.mark.parametrize("n", [10, 1000])
+def test_query_similar_score_threshold_many(mock_pinecone, n):
+    """Test score threshold filtering over many matches"""
+    index = mock_pinecone
+    threshold = 0.8
+    scores = np.random.default_rng(n).random(n).astype(np.float32)
+    index.query.return_value.matches = _make_match_array(
+        [str(i) for i in range(n)], scores, [{"name": f"Restaurant {i}"} for i in range(n)]
+    )
+    
+    results = query_similar(
+        index=index,
+        query_embedding=TEST_EMBEDDING,
+        score_threshold=threshold
+    )
+    
+    result_scores = _assert_result_schema(results)
+    assert len(results) == np.count_nonzero(scores >= threshold)
+    assert (result_scores >= threshold).all()
+
 def test_delete_old_vectors(mock_pinecone):
     """Test deleting old vectors"""
     index = mock_pinecone
@@ -236,11 +388,39 @@ def test_delete_old_vectors(mock_pinecone):
     assert "timestamp" in delete_filter
     assert "$lt" in delete_filter["timestamp"]
 
+def test_delete_old_vectors_through_index(mock_pinecone):
+    """Test that delete_old_vectors removes only stale rows from the mock index"""
+    index = init_pinecone()
+    chunks = _distinct_chunks(3)
+    assert upsert_embeddings(index, chunks) is True
+    stale_embedding = np.random.default_rng(8).random(1536, dtype=np.float32)
+    index.upsert(vectors=[("stale", stale_embedding, {"timestamp": time.time() - 31 * 24 * 60 * 60})])
+    
+    assert delete_old_vectors(index, days_old=30) is True
+    
+    assert set(index.vectors) == {"chunk0", "chunk1", "chunk2"}
+    results = query_similar(index, stale_embedding, top_k=10, score_threshold=0.0)
+    assert "stale" not in {r["id"] for r in results}
+    # Remaining rows still line up with their vectors after the slice
+    assert query_similar(index, chunks[2].embedding, top_k=1, score_threshold=0.0)[0]["id"] == "chunk2"
+
+def test_delete_by_ids_through_index(mock_pinecone):
+    """Test deleting rows by id from the mock index"""
+    index = init_pinecone()
+    chunks = _distinct_chunks(3)
+    assert upsert_embeddings(index, chunks) is True
+    
+    index.delete(ids=["chunk0", "missing"])
+    
+    assert set(index.vectors) == {"chunk1", "chunk2"}
+    results = query_similar(index, chunks[0].embedding, top_k=10, score_threshold=0.0)
+    assert sorted(r["id"] for r in results) == ["chunk1", "chunk2"]
+
 @pytest.mark.asyncio
 async def test_end_to_end_vector_search(mock_pinecone, mock_openai):
     """Test the complete vector search flow"""
     # Mock get_embedding function
-    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=[0.1] * 1536)):
+    with patch('src.embedding.get_embedding', new=AsyncMock(return_value=TEST_EMBEDDING)):
         # Create test embedding
         embedding = await create_restaurant_embedding(TEST_RESTAURANT)
         assert embedding is not None
@@ -250,13 +430,20 @@ async def test_end_to_end_vector_search(mock_pinecone, mock_openai):
         success = upsert_embeddings(index, [embedding])
         assert success is True
         
-        # Generate query embedding
+        # Generate the query embedding; repeats of the same query hit the cache
         query = "Italian restaurants with good pasta"
-        query_embedding = await get_embedding(query)
+        lookups = [await get_embedding(query) for _ in range(3)]
+        query_embedding = lookups[0]
         assert query_embedding is not None
+        assert all(e == query_embedding for e in lookups)
+        
+        # Only the first lookup of the query reached the OpenAI client
+        create = mock_openai.return_value.embeddings.create
+        assert create.call_count == 1
+        assert create.call_args.kwargs["input"] == query
         
         # Mock query response
-        mock_match = Mock(
+        mock_match = _Match(
             id="test123",
             score=0.85,
             metadata={
@@ -276,8 +463,6 @@ async def test_end_to_end_vector_search(mock_pinecone, mock_openai):
         )
         
         assert len(results) > 0
-        for result in results:
-            assert isinstance(result, dict)
-            assert "id" in result
-            assert "score" in result
-            assert "metadata" in result 
\ No newline at end of file
+        scores = _assert_result_schema(results)
+        assert np.all(scores >= 0.7)  # query_similar's default score_threshold
+ 
\ No newline at end of file
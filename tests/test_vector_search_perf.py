@@ -0,0 +1,46 @@
+"""Benchmarks for vector search; skipped unless pytest-benchmark is installed."""
+
+import importlib.util
+
+import numpy as np
+import pytest
+from src.vector_db import query_similar
+
+pytestmark = pytest.mark.unit
+
+HAS_BENCH = importlib.util.find_spec("pytest_benchmark") is not None
+
+N_VECTORS = 10_000
+DIMENSION = 1536
+TOP_K = 10
+
+# Shared read-only query vector
+QUERY_EMBEDDING = np.full(DIMENSION, 0.1, dtype=np.float32)
+QUERY_EMBEDDING.flags.writeable = False
+
+@pytest.fixture(scope="module")
+def populated_index(mock_index_factory):
+    """Mock index holding N_VECTORS random vectors, so benchmarks time its NumPy scoring"""
+    mat = np.random.default_rng(0).random((N_VECTORS, DIMENSION), dtype=np.float32)
+    index = mock_index_factory(dimension=DIMENSION)
+    index.upsert(vectors=[
+        (f"vec{i}", mat[i], {"restaurant_name": f"Restaurant {i}"})
+        for i in range(N_VECTORS)
+    ])
+    return index
+
+@pytest.mark.skipif(not HAS_BENCH, reason="pytest-benchmark is not installed")
+@pytest.mark.benchmark(group="query")
+def test_query_similar_top_k(benchmark, populated_index):
+    """Benchmark query_similar top-k against a 10k-vector index"""
+    results = benchmark(
+        query_similar,
+        index=populated_index,
+        query_embedding=QUERY_EMBEDDING,
+        top_k=TOP_K,
+        score_threshold=0.0
+    )
+
+    assert len(results) == TOP_K
+    scores = np.array([r["score"] for r in results])
+    assert np.all(np.diff(scores) <= 0)